@@ -1,23 +1,48 @@
+import logging
+import os
+import tempfile
+import time
+import uuid
+
 import streamlit as st
-import numpy as np
 import cv2
-import tensorflow as tf
-from tensorflow.keras.models import load_model
 from streamlit_cropper import st_cropper
 from PIL import Image
-import base64
-
-# --- Constants ---
-FIRST_MODEL_PATH = "EyeDetect.keras"
-FIRST_CLASS_NAMES = ["Eye Detected", "No Eye Detected"]
-SEC_MODEL_PATH = "EyeAnalysis.keras"
-SEC_CLASS_NAMES = ["Healthy", "Pinguecula", "Pterygium Stage 1 (Trace-Mild)", "Pterygium Stage 2 (Moderate-Severe)", "Red Eye(Conjunctivitis)"]
-# เพิ่ม path ของไฟล์เสียง
-EFFECT_SOUND_PATH = "good-6081.mp3"
 
-# Thresholds
-CONFIDENCE_THRESHOLD = 0.60
-MARGIN_THRESHOLD = 0.10
+from config import (
+    FIRST_MODEL_PATH, SEC_MODEL_PATH, EFFECT_SOUND_PATH, PLOP_SOUND_PATH, AUDIO_MODE,
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_S,
+    SOURCE_CACHE_ENTRIES, METRICS_ENABLED, METRICS_PORT, METRICS_HOST,
+    EXECUTION_MODE, SPECULATIVE_WORKERS, QUALITY_MODE,
+    SESSION_IMAGE_BUDGET_MB, GLOBAL_IMAGE_BUDGET_MB, SESSION_IDLE_TTL_S,
+    AUTOCROP_ENABLED, AUTOCROP_MAX_WINDOWS, AUTOCROP_SKIP_CONFIDENCE, TTA_VIEWS,
+    INFERENCE_WORKERS, WORKER_RING_SLOTS, WORKER_STALL_TIMEOUT_S, TUNING_PROFILE_PATH,
+    VIDEO_SAMPLE_FPS, VIDEO_MAX_FRAMES, VIDEO_MIN_SHARPNESS, VIDEO_DUPLICATE_THRESHOLD, VIDEO_BATCH_SIZE,
+)
+from inference import (
+    preprocess_image, fit_to_model, detection_label, condition_label,
+    build_cascade, run_cascade, decode_cascade, load_inference_model, model_files, final_label,
+    eye_blocks_condition,
+)
+from batching import MicroBatcher
+from cache import PredictionCache, model_identity
+from assets import SoundLibrary
+from model_loader import ModelLoader
+from speculative import SpeculativeExecutor
+from session_store import SessionImageStore
+from worker_pool import WorkerPool, resolve_worker_count
+from tuning import load_profile, apply_profile, profile_jit_compile, tuned_batch_size
+from video import analyze_video
+from quality import assess, gate
+import metrics
+from imaging import upload_digest, decode_proxy, decode_source, map_box, crop_box
+from autocrop import propose_crop, cropper_box_algorithm
+from tta import augment_views, average_predictions
+
+# Startup timings and batching/cache stats are reported through logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+if METRICS_ENABLED:
+    metrics.enable(METRICS_PORT, METRICS_HOST)
 
 # --- Translation Data ---
 TEXTS = {
@@ -49,13 +74,33 @@ TEXTS = {
         "camera_section_desc": "Capture a real-time photo of your eye. Ensure good lighting for best results.",
         "camera_label": "Take a Photo of Your Eye",
         "camera_help": "Take a photo of your eye using your device's camera.",
+        "tab_use_video": "🎞️ Use Video",
+        "video_section_title": "🎞️ Analyze a Short Eye Video",
+        "video_section_desc": "Upload a few seconds of video of your eye. We pick the clearest frames, analyze them together and show you the best one.",
+        "video_uploader_label": "Drag & Drop or Click to Upload Video",
+        "video_uploader_help": "A short video (MP4, MOV, AVI, WEBM) where your eye is clearly visible.",
+        "analyze_video_button": "🚀 Analyze Eye Video",
+        "analyzing_video": "Analyzing video frames... please wait.",
+        "video_summary": "Analyzed {} clear frames out of {} read.",
+        "best_frame_caption": "Clearest frame ({:.1f}s)",
+        "video_no_frames": "No clear frames were found in this video. Please record again in good light and hold the camera steady.",
+        "video_unreadable": "❌ This video could not be read. Please try another file.",
         "crop_step_title": "✂️ Step 2: Crop Your Image",
         "crop_step_info": "Drag the box to perfectly frame your eye. A precise crop leads to more accurate analysis.",
         "cropped_image_caption": "✅ Cropped Image Ready for Analysis",
+        "auto_crop_info": "👁️ We found your eye and cropped the image for you ({:.0f}% sure).",
+        "adjust_crop_label": "Adjust the crop myself",
         "analyze_step_title": "🔬 Step 3: Get Your Analysis",
         "analyze_step_info": "Once satisfied with your cropped image, click 'Analyze' to see the AI's findings.",
         "analyze_button": "🚀 Analyze Eye Image",
         "analysis_results_header": "📊 Analysis Results",
+        "analyzed_crop_caption": "Analyzed crop",
+        "quality_rejected": "❌ This photo is not clear enough to analyze reliably. Please take or upload a new one:",
+        "quality_warning": "⚠️ This photo may not give a reliable result:",
+        "quality_too_small": "The cropped eye is very small. Move closer or use a higher-resolution photo.",
+        "quality_blurry": "The photo is blurry. Hold the camera steady and let it focus on your eye.",
+        "quality_too_dark": "The photo is too dark. Move to a brighter place.",
+        "quality_too_bright": "The photo is overexposed. Avoid direct light or flash on your eye.",
         "eye_detection_result_title": "Eye Detection Result",
         "eye_condition_analysis_title": "Eye Condition Analysis",
         "no_eye_detected_error": "❌ **No Eye Detected**",
@@ -88,8 +133,7 @@ TEXTS = {
         """,
         "red_eye_consult_doctor": "⚠️ **Please consult a healthcare professional or ophthalmologist:** To determine the cause of the redness and receive appropriate treatment.",
         "initial_message": "Upload or capture an image in **Step 1** above, then crop it in **Step 2**. The analysis button will appear here once ready!",
-        "loading_first_model": "🚀 กำลังโหลดโมเดล AI สำหรับตรวจจับดวงตา...",
-        "loading_sec_model": "🧠 กำลังโหลดโมเดล AI สำหรับวิเคราะห์สภาพตา...",
+        "loading_models": "🚀 Loading the AI models, this only happens once...",
         "analyzing_image": "กำลังวิเคราะห์รูปภาพ... กรุณารอสักครู่ครับ",
         "language_selector_label": "Select Language",
         "sidebar_settings_title": "Settings"
@@ -122,13 +166,33 @@ TEXTS = {
         "camera_section_desc": "ถ่ายรูปดวงตาควรตรวจสอบให้มีแสงสว่างพอเหมาะเพื่อภาพที่ชัดเจนครับ",
         "camera_label": "ถ่ายรูปดวงตาของคุณครับ",
         "camera_help": "ถ่ายรูปดวงตาด้วยกล้องอุปกรณ์ของคุณครับ",
+        "tab_use_video": "🎞️ ใช้วิดีโอ",
+        "video_section_title": "🎞️ วิเคราะห์จากวิดีโอดวงตาสั้นๆ",
+        "video_section_desc": "อัปโหลดวิดีโอดวงตาสั้นๆ ไม่กี่วินาที ระบบจะเลือกเฟรมที่ชัดที่สุดมาวิเคราะห์รวมกันและแสดงเฟรมที่ดีที่สุดให้ดูครับ",
+        "video_uploader_label": "ลากวิดีโอมาวางหรือคลิกเพื่อเลือกไฟล์",
+        "video_uploader_help": "วิดีโอสั้น (MP4, MOV, AVI, WEBM) ที่เห็นดวงตาชัดเจนครับ",
+        "analyze_video_button": "🚀 วิเคราะห์วิดีโอดวงตา",
+        "analyzing_video": "กำลังวิเคราะห์เฟรมในวิดีโอ... กรุณารอสักครู่ครับ",
+        "video_summary": "วิเคราะห์เฟรมที่ชัด {} เฟรม จากทั้งหมด {} เฟรมที่อ่าน",
+        "best_frame_caption": "เฟรมที่ชัดที่สุด ({:.1f} วินาที)",
+        "video_no_frames": "ไม่พบเฟรมที่ชัดในวิดีโอนี้ ลองถ่ายใหม่ในที่แสงสว่างและถือกล้องให้นิ่งนะครับ",
+        "video_unreadable": "❌ ไม่สามารถอ่านวิดีโอนี้ได้ ลองใช้ไฟล์อื่นนะครับ",
         "crop_step_title": "✂️ ขั้นตอนที่ 2: ครอบตัดรูปของคุณ",
         "crop_step_info": "ลากกรอบครอบให้พอดีกับดวงตา",
         "cropped_image_caption": "✅ รูปที่ครอบตัดพร้อมสำหรับวิเคราะห์",
+        "auto_crop_info": "👁️ AI เจอดวงตาและครอบตัดรูปให้แล้วครับ (มั่นใจ {:.0f}%)",
+        "adjust_crop_label": "ขอครอบตัดเอง",
         "analyze_step_title": "🔬 ขั้นตอนที่ 3: ผลวิเคราะห์",
         "analyze_step_info": "เมื่อพอใจกับรูปที่ครอบแล้วสามารถกดปุ่ม 'วิเคราะห์' เพื่อดูผลได้ครับ",
         "analyze_button": "🚀 วิเคราะห์รูปดวงตา",
         "analysis_results_header": "📊 ผลวิเคราะห์",
+        "analyzed_crop_caption": "รูปที่วิเคราะห์",
+        "quality_rejected": "❌ รูปนี้ยังไม่ชัดพอสำหรับการวิเคราะห์ กรุณาถ่ายหรืออัปโหลดรูปใหม่ครับ:",
+        "quality_warning": "⚠️ รูปนี้อาจทำให้ผลวิเคราะห์ไม่แม่นยำ:",
+        "quality_too_small": "ดวงตาในรูปที่ครอปมีขนาดเล็กมาก ลองถ่ายใกล้ขึ้นหรือใช้รูปที่ความละเอียดสูงกว่านี้ครับ",
+        "quality_blurry": "รูปเบลอ ถือกล้องให้นิ่งและรอให้กล้องโฟกัสที่ดวงตาก่อนครับ",
+        "quality_too_dark": "รูปมืดเกินไป ลองย้ายไปที่ที่มีแสงสว่างมากขึ้นครับ",
+        "quality_too_bright": "รูปสว่างเกินไป หลีกเลี่ยงแสงหรือแฟลชที่ส่องตรงเข้าดวงตาครับ",
         "eye_detection_result_title": "ผลตรวจจับรูปดวงตา",
         "eye_condition_analysis_title": "ผลวิเคราะห์สภาพดวงตาครับ",
         "no_eye_detected_error": "❌ **ไม่พบดวงตา**",
@@ -150,8 +214,7 @@ TEXTS = {
     ตาแดงอาจเกิดได้จากหลายสาเหตุ เช่น การระคายเคือง, ภูมิแพ้, การติดเชื้อ หรือภาวะทางการแพทย์อื่น ๆ แม้ว่ามักจะไม่เป็นอันตราย แต่หากตาแดงมีอาการต่อเนื่องหรือรุนแรง โดยเฉพาะอย่างยิ่งมีอาการปวด, มีขี้ตา, หรือการมองเห็นเปลี่ยนแปลงไป ควรปรึกษาแพทย์""",
         "red_eye_consult_doctor": "⚠️ **โปรดปรึกษาแพทย์หรือจักษุแพทย์:** เพื่อหาสาเหตุของตาแดงและรับการรักษาที่เหมาะสมครับ",
         "initial_message": "อัปโหลดหรือถ่ายรูปใน **ขั้นตอนที่ 1** แล้วครอบตัดใน **ขั้นตอนที่ 2** ปุ่มวิเคราะห์จะโผล่มาเมื่อพร้อมใช้งานครับ!",
-        "loading_first_model": "🚀 กำลังโหลดโมเดล AI สำหรับตรวจจับดวงตา...",
-        "loading_sec_model": "🧠 กำลังโหลดโมเดล AI สำหรับวิเคราะห์สภาพตา...",
+        "loading_models": "🚀 กำลังโหลดโมเดล AI กรุณารอสักครู่ครับ...",
         "analyzing_image": "กำลังวิเคราะห์รูปภาพ... กรุณารอสักครู่ครับ",
         "language_selector_label": "เลือกภาษา",
         "sidebar_settings_title": "Settings"
@@ -168,17 +231,13 @@ def get_text(key, *args):
         return text.format(*args)
     return text
 
-def play_audio(file_path):
-    with open(file_path, "rb") as f:
-        audio_bytes = f.read()
-        audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
-    audio_html = f"""
-    <audio autoplay="true">
-        <source src="data:audio/mp3;base64,{audio_b64}" type="audio/mp3">
-        Your browser does not support the audio element.
-    </audio>
-    """
-    st.markdown(audio_html, unsafe_allow_html=True)
+@st.cache_resource
+def load_sounds():
+    """Reads every sound effect once per process."""
+    return SoundLibrary({"effect": EFFECT_SOUND_PATH, "plop": PLOP_SOUND_PATH}, mode=AUDIO_MODE)
+
+def play_audio(sound_name):
+    load_sounds().play(sound_name)
 
 
 # --- Page Configuration ---
@@ -282,6 +341,10 @@ hr {
 .step p {
     color: white;
 }
+/* Sound effects autoplay without showing a player */
+[data-testid="stAudio"] {
+    display: none;
+}
 /* Keyframes สำหรับ Animation */
 @keyframes fadeInDown {
     0% {
@@ -297,73 +360,240 @@ hr {
 """, unsafe_allow_html=True)
 
 # --- Initialize session state for image management ---
-if 'img_raw_bytes' not in st.session_state:
-    st.session_state.img_raw_bytes = None
-if 'img_for_prediction' not in st.session_state:
-    st.session_state.img_for_prediction = None
+# Only the upload's digest lives in st.session_state; the raw bytes stay with the
+# input widget and the crop lives in the process-wide, memory-bounded image store
+if 'img_digest' not in st.session_state:
+    st.session_state.img_digest = None
+if 'image_store_id' not in st.session_state:
+    st.session_state.image_store_id = uuid.uuid4().hex
 if 'current_input_method' not in st.session_state:
     st.session_state.current_input_method = "none"
 
-# --- Load Models (Cached) ---
 @st.cache_resource
+def load_session_store():
+    store = SessionImageStore(
+        per_session_bytes=SESSION_IMAGE_BUDGET_MB * 2**20,
+        global_bytes=GLOBAL_IMAGE_BUDGET_MB * 2**20,
+        idle_seconds=SESSION_IDLE_TTL_S,
+    )
+    metrics.gauge_callback("ocuscan_session_image_bytes", lambda: {(): store.usage()["bytes"]})
+    metrics.gauge_callback("ocuscan_session_image_sessions", lambda: {(): store.usage()["sessions"]})
+    return store
+
+def get_image_for_prediction():
+    """The current crop (BGR, fitted to the model input size), or None."""
+    return load_session_store().get(st.session_state.image_store_id, "img_for_prediction")
+
+def set_image_for_prediction(image_np):
+    if image_np is None:
+        load_session_store().discard(st.session_state.image_store_id, "img_for_prediction")
+        st.session_state.pop("img_quality", None)
+    else:
+        # Same resize the API and batch scorer use, so storing the smaller copy
+        # does not change what the models see
+        load_session_store().put(st.session_state.image_store_id, "img_for_prediction",
+                                 fit_to_model(image_np))
+        # Measured on the full crop: the fitted copy hides its real resolution and
+        # an upscaled small crop would look blurrier than it is
+        if QUALITY_MODE != "off":
+            with metrics.timed("quality"):
+                st.session_state.img_quality = assess(image_np)
+
+# --- Load Models (in the background, once per process) ---
 def load_first_model():
-    with st.spinner(get_text("loading_first_model")):
-        try:
-            model = load_model(FIRST_MODEL_PATH)
-            return model
-        except Exception as e:
-            st.error(f"❌ Failed to load eye detection model: {e}. Please ensure '{FIRST_MODEL_PATH}' is in the correct directory.")
-            st.stop()
+    return load_inference_model(FIRST_MODEL_PATH)
 
-@st.cache_resource
 def load_sec_model():
-    with st.spinner(get_text("loading_sec_model")):
-        try:
-            model = load_model(SEC_MODEL_PATH)
-            return model
-        except Exception as e:
-            st.error(f"❌ Failed to load eye condition model: {e}. Please ensure '{SEC_MODEL_PATH}' is in the correct directory.")
-            st.stop()
-
-first_model = load_first_model()
-sec_model = load_sec_model()
-
-# --- Preprocessing ---
-def preprocess_image(image_np, target_size=(320, 280)):
-    """Resizes, converts to RGB, and expands dimensions for model input."""
-    image_resized = cv2.resize(image_np, target_size)
-    image_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
-    image_array = np.expand_dims(image_rgb.astype("float32"), axis=0)
-    return image_array
+    return load_inference_model(SEC_MODEL_PATH)
+
+@st.cache_resource
+def load_tuning_profile():
+    return load_profile(TUNING_PROFILE_PATH)
+
+# With inference worker processes the models live only in the workers: this
+# process never imports TensorFlow, every analysis (and video) goes through the
+# pool as the fused cascade, and auto-crop is off because it needs EyeDetect here
+POOL_WORKERS = resolve_worker_count(INFERENCE_WORKERS)
+
+@st.cache_resource
+def start_model_loading():
+    """Starts importing TensorFlow and loading both models without blocking the page.
+    The tuning profile, if any, is applied first. Not used with worker processes."""
+    profile = load_tuning_profile()
+    return ModelLoader(
+        load_first_model, load_sec_model,
+        lambda first, sec: build_cascade(first, sec, jit_compile=profile_jit_compile(profile), tta_views=TTA_VIEWS),
+        configure=lambda: apply_profile(profile),
+    )
+
+def wait_for_models():
+    """Returns (first_model, sec_model, cascade), waiting for the background load if needed."""
+    loader = start_model_loading()
+    try:
+        if not loader.ready():
+            with st.spinner(get_text("loading_models")), metrics.timed("model_wait"):
+                return loader.wait()
+        return loader.wait()
+    except Exception as e:
+        st.error(f"❌ Failed to load AI models: {e}. Please ensure '{model_files()[0]}' and '{model_files()[1]}' are in the correct directory.")
+        st.stop()
+
+@st.cache_resource
+def load_batcher(_cascade):
+    """One scheduler per process, shared by every session: a pool of inference
+    worker processes when OCUSCAN_INFERENCE_WORKERS is set, otherwise an
+    in-process micro-batcher."""
+    profile = load_tuning_profile()
+    max_batch_size = tuned_batch_size(profile, BATCH_MAX_SIZE)
+    if POOL_WORKERS:
+        batcher = WorkerPool(POOL_WORKERS, slots_per_worker=WORKER_RING_SLOTS, max_batch_size=max_batch_size,
+                             stall_timeout=WORKER_STALL_TIMEOUT_S, profile=profile)
+    else:
+        def run_batch(batch):
+            with metrics.timed("cascade_batch"):
+                return decode_cascade(run_cascade(_cascade, batch))
+
+        batcher = MicroBatcher(run_batch, max_batch_size=max_batch_size, max_wait_ms=BATCH_MAX_WAIT_MS)
+    metrics.gauge_callback("ocuscan_batch_queue_depth", lambda: {(): batcher.stats()["queue_depth"]})
+    metrics.gauge_callback("ocuscan_batch_mean_size", lambda: {(): batcher.stats()["mean_batch_size"]})
+    return batcher
+
+def get_batcher():
+    """The shared scheduler, waiting for the models (in this process or in the
+    workers) if they are still loading."""
+    if not POOL_WORKERS:
+        return load_batcher(wait_for_models()[2])
+    pool = load_batcher(None)
+    if not pool.ready() and pool.error is None:
+        with st.spinner(get_text("loading_models")), metrics.timed("model_wait"):
+            while not pool.ready() and pool.error is None:
+                time.sleep(0.1)
+    if pool.error is not None:
+        st.error(f"❌ Failed to load AI models: {pool.error}")
+        st.stop()
+    return pool
+
+def predict_batch(crops):
+    """Scores a stack of model-size crops through the shared scheduler."""
+    batcher = get_batcher()
+    return [future.result() for future in [batcher.submit(crop) for crop in crops]]
+
+if POOL_WORKERS:
+    load_batcher(None)  # Starts the worker processes, which load the models
+else:
+    start_model_loading()
+load_sounds()
+
+@st.cache_resource
+def load_speculative_executor(_first_model, _sec_model):
+    """Shared pool that runs both models at once in "speculative" mode."""
+    def detect(processed_image):
+        with metrics.timed("predict_first_model"):
+            return detection_label(_first_model.predict(processed_image, verbose=0)[0])
+
+    def classify(processed_image):
+        return condition_label(score_condition(_sec_model, processed_image))
+
+    return SpeculativeExecutor(detect, classify, eye_blocks_condition, max_workers=SPECULATIVE_WORKERS)
+
+@st.cache_resource
+def load_prediction_cache():
+    """Results shared across reruns and sessions, keyed by crop pixels and model files."""
+    return PredictionCache(
+        max_entries=PREDICTION_CACHE_SIZE,
+        ttl_seconds=PREDICTION_CACHE_TTL_S,
+        namespace=f"{model_identity(*model_files())}:tta{TTA_VIEWS}",
+    )
 
 # --- Prediction Logic ---
+def score_condition(sec_model, processed_image):
+    """EyeAnalysis probabilities for one preprocessed crop; with TTA_VIEWS > 1 the
+    augmented views run as one batch and their probabilities are averaged."""
+    if TTA_VIEWS <= 1:
+        with metrics.timed("predict_sec_model"):
+            return sec_model.predict(processed_image, verbose=0)[0]
+    with metrics.timed("tta_augment"):
+        views = augment_views(processed_image, TTA_VIEWS)
+    with metrics.timed("predict_sec_model_tta"):
+        return average_predictions(sec_model.predict(views, verbose=0))
+
 def predict_eye_detection(image_np):
-    processed_image = preprocess_image(image_np)
-    prediction = first_model.predict(processed_image)[0]
-    predicted_class_index = np.argmax(prediction)
-    confidence = prediction[predicted_class_index]
-    return FIRST_CLASS_NAMES[predicted_class_index], confidence
+    with metrics.timed("preprocess"):
+        processed_image = preprocess_image(image_np)
+    first_model, _, _ = wait_for_models()
+    with metrics.timed("predict_first_model"):
+        prediction = first_model.predict(processed_image)[0]
+    return detection_label(prediction)
 
 def predict_eye_condition(image_np):
-    processed_image = preprocess_image(image_np)
-    prediction = sec_model.predict(processed_image)[0]
-
-    top_2 = np.sort(prediction)[-2:]
-    confidence = top_2[-1]
-    margin = top_2[-1] - top_2[-2]
-
-    predicted_class_index = np.argmax(prediction)
+    with metrics.timed("preprocess"):
+        processed_image = preprocess_image(image_np)
+    _, sec_model, _ = wait_for_models()
+    return condition_label(score_condition(sec_model, processed_image))
+
+def run_analysis(image_np, mode=EXECUTION_MODE):
+    """Runs both models on a crop using the configured execution mode:
+
+    - "cascade": one fused graph, batched together with other sessions' requests;
+      with TTA_VIEWS > 1 the augmented views are part of that graph
+    - "speculative": both models start at once; the condition result is dropped
+      if detection finds no eye
+    - "serial": detection first, condition only when an eye was found
+
+    With inference worker processes only "cascade" is available, since the
+    models are not loaded in this process.
+    """
+    if mode == "cascade" or POOL_WORKERS:
+        # Only a uint8 resize happens here; the cascade converts to float RGB itself
+        with metrics.timed("preprocess"):
+            crop = fit_to_model(image_np)
+        batcher = get_batcher()
+        with metrics.timed("inference"):
+            return batcher.predict(crop)
+
+    first_model, sec_model, _ = wait_for_models()
+
+    if mode == "speculative":
+        with metrics.timed("preprocess"):
+            processed_image = preprocess_image(image_np)
+        with metrics.timed("inference"):
+            (eye_label, eye_confidence), condition = \
+                load_speculative_executor(first_model, sec_model).run(processed_image)
+    elif mode == "serial":
+        eye_label, eye_confidence = predict_eye_detection(image_np)
+        condition = None
+        if not eye_blocks_condition(eye_label, eye_confidence):
+            condition = predict_eye_condition(image_np)
+    else:
+        raise ValueError(f"Unknown execution mode '{mode}'")
+
+    condition_name, condition_confidence = condition if condition is not None else (None, None)
+    return {
+        "eye_label": eye_label,
+        "eye_confidence": eye_confidence,
+        "no_eye": condition is None,
+        "condition_label": condition_name,
+        "condition_confidence": condition_confidence,
+    }
 
-    if confidence < CONFIDENCE_THRESHOLD or margin < MARGIN_THRESHOLD:
-        return "Uncertain", confidence
-    return SEC_CLASS_NAMES[predicted_class_index], confidence
+def analyze_image(image_np):
+    """Analyzes a crop, answering identical crops from the prediction cache."""
+    cache = load_prediction_cache()
+    key = cache.key_for(image_np)
+    result = cache.get(key)
+    metrics.inc("ocuscan_prediction_cache_total", outcome="miss" if result is None else "hit")
+    if result is None:
+        result = run_analysis(image_np)
+        cache.put(key, result)
+    metrics.inc("ocuscan_results_total", result=final_label(result))
+    return result
 
 # --- Helper Function for Display ---
 def display_prediction_result(label, confidence, is_eye_detection=False):
     """Displays prediction results with appropriate styling and advice."""
     # เมื่อมีการแสดงผลลัพธ์ที่เกี่ยวข้องกับสุขภาพตา
     if not is_eye_detection:
-        play_audio(EFFECT_SOUND_PATH) # ย้ายมาไว้ตรงนี้
+        play_audio("effect") # ย้ายมาไว้ตรงนี้
     
     if is_eye_detection:
         if "No Eye" in label:
@@ -397,6 +627,20 @@ def display_prediction_result(label, confidence, is_eye_detection=False):
                 st.markdown(get_text("red_eye_advice"))
                 st.info(get_text("red_eye_consult_doctor"))
 
+def display_analysis(result):
+    """Shows the detection and condition columns for one analysis result."""
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown(f"#### {get_text('eye_detection_result_title')}")
+        display_prediction_result(result["eye_label"], result["eye_confidence"], is_eye_detection=True)
+    if result["no_eye"]:
+        col2.markdown(f"#### {get_text('eye_condition_analysis_title')}")
+        col2.warning(get_text("cannot_analyze_condition"))
+    else:
+        with col2:
+            st.markdown(f"#### {get_text('eye_condition_analysis_title')}")
+            display_prediction_result(result["condition_label"], result["condition_confidence"])
+
 # --- Streamlit UI ---
 
 # Sidebar for language selection
@@ -417,32 +661,45 @@ with st.sidebar:
         st.session_state.language = selected_lang_key
         st.rerun()
 
-# Header Section
-st.markdown(f"<h1>👀 {get_text('app_header')}</h1>", unsafe_allow_html=True)
-st.markdown(f"<p>{get_text('app_subheader')}</p>", unsafe_allow_html=True)
-st.markdown("---")
-
-# Welcome and "How to use" Section
-st.markdown(f"**{get_text('welcome_title')}** {get_text('welcome_message')}")
-st.divider()
-
-st.header(get_text("how_to_use_title"))
-st.markdown(f"""
+# Static sections only change with the language, so their markup is built once per language
+@st.cache_data
+def static_sections(language):
+    texts = TEXTS[language]
+    return {
+        "header": f"<h1>👀 {texts['app_header']}</h1>",
+        "subheader": f"<p>{texts['app_subheader']}</p>",
+        "welcome": f"**{texts['welcome_title']}** {texts['welcome_message']}",
+        "how_to_use": f"""
 <div class="step-container">
     <div class="step">
-        <h3>{get_text("step1_title")}</h3>
-        <p>{get_text("step1_desc")}</p>
+        <h3>{texts["step1_title"]}</h3>
+        <p>{texts["step1_desc"]}</p>
     </div>
     <div class="step">
-        <h3>{get_text("step2_title")}</h3>
-        <p>{get_text("step2_desc")}</p>
+        <h3>{texts["step2_title"]}</h3>
+        <p>{texts["step2_desc"]}</p>
     </div>
     <div class="step">
-        <h3>{get_text("step3_title")}</h3>
-        <p>{get_text("step3_desc")}</p>
+        <h3>{texts["step3_title"]}</h3>
+        <p>{texts["step3_desc"]}</p>
     </div>
 </div>
-""", unsafe_allow_html=True)
+""",
+    }
+
+sections = static_sections(st.session_state.language)
+
+# Header Section
+st.markdown(sections["header"], unsafe_allow_html=True)
+st.markdown(sections["subheader"], unsafe_allow_html=True)
+st.markdown("---")
+
+# Welcome and "How to use" Section
+st.markdown(sections["welcome"])
+st.divider()
+
+st.header(get_text("how_to_use_title"))
+st.markdown(sections["how_to_use"], unsafe_allow_html=True)
 
 st.divider()
 st.info(f"**{get_text('disclaimer_title')}** {get_text('disclaimer_text')}")
@@ -451,55 +708,113 @@ st.divider()
 st.subheader(get_text("start_scan_subheader"))
 st.info(get_text("tip_info"))
 
-tab1, tab2= st.tabs([get_text("tab_upload_image"), get_text("tab_use_camera")])
+tab1, tab2, tab3 = st.tabs([get_text("tab_upload_image"), get_text("tab_use_camera"), get_text("tab_use_video")])
 
 # --- Function to handle image processing and cropping ---
+@st.cache_resource(max_entries=64)
+def load_crop_proxy(digest, _raw_bytes):
+    """Display-sized decode of an upload, shared by every rerun that shows the cropper."""
+    with metrics.timed("decode_proxy"):
+        return decode_proxy(_raw_bytes)
+
+@st.cache_resource(max_entries=SOURCE_CACHE_ENTRIES)
+def load_crop_source(digest, _raw_bytes):
+    """Full-resolution decode of an upload, made once and reused for every crop change."""
+    with metrics.timed("decode_source"):
+        return decode_source(_raw_bytes)
+
+@st.cache_resource(max_entries=64)
+def load_crop_proposal(digest, _img_proxy):
+    """Where EyeDetect thinks the eye is on the proxy, computed once per upload."""
+    first_model, _, _ = wait_for_models()
+    with metrics.timed("autocrop"):
+        proposal = propose_crop(_img_proxy, first_model, max_windows=AUTOCROP_MAX_WINDOWS)
+    if proposal is not None:
+        confident = proposal["confidence"] >= AUTOCROP_SKIP_CONFIDENCE
+        metrics.inc("ocuscan_autocrop_total", outcome="confident" if confident else "proposed")
+    return proposal
+
 def handle_image_input(uploaded_bytes, method_name, cropper_key):
     # Case 1: A new raw image is provided OR the input method has switched
-    if (uploaded_bytes is not None and st.session_state.img_raw_bytes != uploaded_bytes) or \
+    uploaded_digest = upload_digest(uploaded_bytes) if uploaded_bytes is not None else None
+    if (uploaded_bytes is not None and st.session_state.img_digest != uploaded_digest) or \
        (st.session_state.current_input_method != method_name and uploaded_bytes is not None):
-        st.session_state.img_raw_bytes = uploaded_bytes
-        st.session_state.img_for_prediction = None  # Clear previously cropped image
+        st.session_state.img_digest = uploaded_digest
+        set_image_for_prediction(None)  # Clear previously cropped image
         st.session_state.current_input_method = method_name
+        st.session_state.pop(f"{cropper_key}_manual", None)  # A new image starts on the auto-crop again
+        st.session_state.pop(f"{cropper_key}_proposal", None)
         st.rerun() # Trigger a rerun to clear old display elements and re-render with new raw image for cropper
 
     # Case 2: The 'x' button was clicked, or camera input was cleared (uploaded_bytes is None)
     # and the current method matches. This means the user explicitly cleared the input.
     elif uploaded_bytes is None and st.session_state.current_input_method == method_name:
-        if st.session_state.img_raw_bytes is not None: # Only clear if there was an image to begin with
-            st.session_state.img_raw_bytes = None
-            st.session_state.img_for_prediction = None
+        if st.session_state.img_digest is not None: # Only clear if there was an image to begin with
+            st.session_state.img_digest = None
+            set_image_for_prediction(None)
             st.session_state.current_input_method = "none" # Reset active method
             st.rerun() # Trigger a rerun to clear the display
 
     # If the current input method is active and we have raw image bytes
-    if st.session_state.current_input_method == method_name and st.session_state.img_raw_bytes:
-        # Decode bytes to numpy array using OpenCV
-        img_np_decoded = cv2.imdecode(np.frombuffer(st.session_state.img_raw_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if st.session_state.current_input_method == method_name and uploaded_bytes is not None:
+        # Only a display-sized proxy is decoded for the cropper, once per upload
+        img_proxy = load_crop_proxy(st.session_state.img_digest, uploaded_bytes)
         # Convert OpenCV's BGR to PIL's RGB
-        img_pil = Image.fromarray(cv2.cvtColor(img_np_decoded, cv2.COLOR_BGR2RGB))
+        img_pil = Image.fromarray(cv2.cvtColor(img_proxy, cv2.COLOR_BGR2RGB))
+
+        # Decided once per upload, on its first render: later reruns come from the
+        # user dragging the box, which a late proposal must not take over. The
+        # proposal needs EyeDetect, so before it has loaded the cropper starts centred
+        proposal_key = f"{cropper_key}_proposal"
+        decided = st.session_state.get(proposal_key)
+        if decided is None or decided["digest"] != st.session_state.img_digest:
+            proposal = None
+            if AUTOCROP_ENABLED and not POOL_WORKERS and start_model_loading().ready():
+                proposal = load_crop_proposal(st.session_state.img_digest, img_proxy)
+            st.session_state[proposal_key] = {"digest": st.session_state.img_digest, "proposal": proposal}
+        proposal = st.session_state[proposal_key]["proposal"]
 
         st.markdown("### ✂️ Step 2: Crop Your Image")
-        st.info("**Drag the box** to perfectly frame your eye. A precise crop leads to more accurate analysis.")
-        cropped_img = st_cropper(
-            img_pil,
-            aspect_ratio=(320, 280),
-            box_color='#FF4B4B', # A distinct color for the crop box
-            key=cropper_key
-        )
-        if cropped_img:
-            # Update the image for prediction ONLY if the cropper provides a valid output
-            st.session_state.img_for_prediction = cv2.cvtColor(np.array(cropped_img), cv2.COLOR_BGR2RGB) # Ensure RGB for further processing
+        auto_crop = proposal is not None and proposal["confidence"] >= AUTOCROP_SKIP_CONFIDENCE
+        if auto_crop:
+            st.success(get_text("auto_crop_info", proposal["confidence"] * 100))
+            auto_crop = not st.checkbox(get_text("adjust_crop_label"), key=f"{cropper_key}_manual")
+        if auto_crop:
+            # Confident enough to skip the cropper round-trips altogether
+            crop_box_proxy = dict(proposal["box"])
+        else:
+            st.info("**Drag the box** to perfectly frame your eye. A precise crop leads to more accurate analysis.")
+            crop_box_proxy = st_cropper(
+                img_pil,
+                aspect_ratio=(320, 280),
+                box_color='#FF4B4B', # A distinct color for the crop box
+                return_type="box",
+                box_algorithm=cropper_box_algorithm(proposal["box"], img_proxy.shape) if proposal else None,
+                key=cropper_key
+            )
+        if crop_box_proxy:
+            # Update the image for prediction ONLY if the cropper provides a valid output.
+            # The box is mapped back onto the full-resolution decode (kept in BGR, like the models expect)
+            img_source = load_crop_source(st.session_state.img_digest, uploaded_bytes)
+            with metrics.timed("crop"):
+                source_box = map_box(crop_box_proxy, img_proxy.shape, img_source.shape)
+                set_image_for_prediction(crop_box(img_source, source_box))
+            preview = crop_box(img_proxy, map_box(crop_box_proxy, img_proxy.shape, img_proxy.shape))
             st.markdown("---")
-            st.image(cropped_img, caption="✅ Cropped Image Ready for Analysis", use_container_width=True)
+            st.image(preview, channels="BGR", caption="✅ Cropped Image Ready for Analysis", use_container_width=True)
             st.markdown("---")
         else:
-            # If cropped_img is None (e.g., first render of cropper after new upload), ensure img_for_prediction is cleared
-            st.session_state.img_for_prediction = None
+            # If the cropper has no box yet (e.g., first render after new upload), ensure the crop is cleared
+            set_image_for_prediction(None)
 
 
 # --- Image Input & Cropping using Tabs ---
-with tab1:
+# Each tab and the results panel are fragments: dragging the crop box reruns only
+# its tab and clicking Analyze reruns only the results. A new or cleared image
+# still reruns the whole page (st.rerun in handle_image_input) so the Analyze
+# step appears or disappears.
+@st.fragment
+def upload_tab():
     st.markdown(f"### {get_text('upload_section_title')}")
     st.markdown(get_text("upload_section_desc"))
     uploaded_file = st.file_uploader(
@@ -510,7 +825,8 @@ with tab1:
     )
     handle_image_input(uploaded_file.getvalue() if uploaded_file else None, "upload", "uploaded_crop")
 
-with tab2:
+@st.fragment
+def camera_tab():
     st.markdown(f"### {get_text('camera_section_title')}")
     st.markdown(get_text("camera_section_desc"))
     camera_input = st.camera_input(
@@ -520,29 +836,96 @@ with tab2:
     )
     handle_image_input(camera_input.getvalue() if camera_input else None, "camera", "camera_crop")
 
+@st.cache_resource(max_entries=16)
+def analyze_video_upload(digest, _raw_bytes, suffix):
+    """Scores an uploaded video once; re-clicking Analyze reuses the result."""
+    # The eye is located with EyeDetect in this process, so not with worker processes
+    first_model = wait_for_models()[0] if AUTOCROP_ENABLED and not POOL_WORKERS else None
+    # cv2.VideoCapture reads from a path, so the upload is spooled to a temporary file
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(_raw_bytes)
+    try:
+        with metrics.timed("video"):
+            return analyze_video(
+                f.name, predict_batch, first_model, batch_size=VIDEO_BATCH_SIZE,
+                sample_fps=VIDEO_SAMPLE_FPS, max_frames=VIDEO_MAX_FRAMES, min_sharpness=VIDEO_MIN_SHARPNESS,
+                duplicate_threshold=VIDEO_DUPLICATE_THRESHOLD,
+            )
+    finally:
+        os.remove(f.name)
+
+@st.fragment
+def video_tab():
+    st.markdown(f"### {get_text('video_section_title')}")
+    st.markdown(get_text("video_section_desc"))
+    video_file = st.file_uploader(
+        get_text("video_uploader_label"),
+        type=["mp4", "mov", "avi", "webm", "mkv"],
+        help=get_text("video_uploader_help"),
+        key="video_widget"
+    )
+    if video_file is None:
+        return
+    if not st.button(get_text("analyze_video_button"), type="primary", use_container_width=True, key="analyze_video"):
+        return
+    raw_bytes = video_file.getvalue()
+    with st.spinner(get_text("analyzing_video")), metrics.request_trace("video_analysis") as trace:
+        try:
+            result = analyze_video_upload(upload_digest(raw_bytes), raw_bytes, os.path.splitext(video_file.name)[1])
+        except ValueError:
+            st.error(get_text("video_unreadable"))
+            return
+        if not result["frames"]:
+            st.warning(get_text("video_no_frames"))
+            return
+        trace.annotate(result=final_label(result), frames=result["frames"])
+        metrics.inc("ocuscan_results_total", result=final_label(result))
+        st.subheader(get_text("analysis_results_header"))
+        st.caption(get_text("video_summary", result["frames"], result["sampling"]["frames_read"]))
+        best_frame = result["best_frame"]
+        st.image(best_frame["image"], channels="BGR", width=240,
+                 caption=get_text("best_frame_caption", best_frame["seconds"]))
+        display_analysis(result)
+
+with tab1:
+    upload_tab()
+
+with tab2:
+    camera_tab()
+
+with tab3:
+    video_tab()
+
 st.divider()
 
 # --- Prediction Button & Results ---
-if st.session_state.img_for_prediction is not None:
+@st.fragment
+def analysis_section():
+    # Read on every run of the fragment, so a click always analyzes the latest crop
+    img_for_prediction = get_image_for_prediction()
+    if img_for_prediction is None:
+        st.info(get_text("initial_message"))
+        return
     st.markdown(f"### {get_text('analyze_step_title')}")
     st.info(get_text("analyze_step_info"))
     if st.button(get_text("analyze_button"), type="primary", use_container_width=True):
         st.subheader(get_text("analysis_results_header"))
-        with st.spinner(get_text("analyzing_image")):
-            col1, col2 = st.columns(2)
-            with col1:
-                st.markdown(f"#### {get_text('eye_detection_result_title')}")
-                eye_label, eye_confidence = predict_eye_detection(st.session_state.img_for_prediction)
-                display_prediction_result(eye_label, eye_confidence, is_eye_detection=True)
-            if "No Eye Detected" in eye_label and eye_confidence > CONFIDENCE_THRESHOLD:
-                col2.markdown(f"#### {get_text('eye_condition_analysis_title')}")
-                col2.warning(get_text("cannot_analyze_condition"))
-            else:
-                with col2:
-                    st.markdown(f"#### {get_text('eye_condition_analysis_title')}")
-                    condition_label, condition_confidence = predict_eye_condition(st.session_state.img_for_prediction)
-                    display_prediction_result(condition_label, condition_confidence)
-else:
-    st.info(get_text("initial_message"))
+        # The crop can change later without rerunning this panel, so show what was analyzed
+        st.image(img_for_prediction, channels="BGR", caption=get_text("analyzed_crop_caption"), width=160)
+        # Checked before any model call, so a hopeless crop costs a few milliseconds instead of two models
+        report, rejected = gate(img_for_prediction, report=st.session_state.get("img_quality"))
+        if report and report["problems"]:
+            advice = "\n".join(f"- {get_text('quality_' + problem)}" for problem in report["problems"])
+            if rejected:
+                st.error(f"{get_text('quality_rejected')}\n{advice}")
+                return
+            st.warning(f"{get_text('quality_warning')}\n{advice}")
+        with st.spinner(get_text("analyzing_image")), metrics.request_trace("analysis") as trace:
+            result = analyze_image(img_for_prediction)
+            trace.annotate(result=final_label(result), method=st.session_state.current_input_method)
+            with metrics.timed("render"):
+                display_analysis(result)
+
+analysis_section()
 
 st.divider()
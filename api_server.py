@@ -0,0 +1,372 @@
+"""Local HTTP inference API, for clients that send eye photos without the browser UI.
+
+    python api_server.py serve --port 8600
+    python api_server.py load-test http://127.0.0.1:8600 imgs/ --concurrency 16 --requests 500
+
+Endpoints:
+
+    POST /v1/analyze         one image, as the raw request body or a multipart "image" field
+    POST /v1/analyze/batch   several images as multipart file fields
+    GET  /healthz            model loading state and batching statistics
+    GET  /metrics            Prometheus metrics, when OCUSCAN_METRICS is on
+
+Images should already be cropped to the eye, as in the UI. Each result has the
+same fields as a batch_score.py record. The models are loaded once per process,
+and every request goes through the same micro-batched cascade as the UI.
+With OCUSCAN_QUALITY_MODE=reject, images that fail the quality gate get an
+error instead of a result and never reach the models.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiohttp import web, ClientSession, FormData, TCPConnector
+
+import metrics
+from config import (
+    FIRST_MODEL_PATH, SEC_MODEL_PATH, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, METRICS_ENABLED,
+    API_HOST, API_PORT, API_MAX_BODY_MB, API_MAX_IMAGES, API_MAX_PIXELS, API_MAX_CONCURRENCY,
+    API_QUEUE_TIMEOUT_S, API_KEEPALIVE_S, INFERENCE_WORKERS, WORKER_RING_SLOTS, WORKER_STALL_TIMEOUT_S,
+    TUNING_PROFILE_PATH, TTA_VIEWS,
+)
+from inference import load_inference_model, build_cascade, run_cascade, decode_cascade
+from batching import MicroBatcher
+from model_loader import ModelLoader
+from imaging import source_size
+from batch_score import iter_images, load_and_preprocess, to_record
+from worker_pool import WorkerPool, resolve_worker_count
+from tuning import load_profile, apply_profile, profile_jit_compile, tuned_batch_size
+from quality import gate
+
+logger = logging.getLogger(__name__)
+
+UNREADABLE_HEADER = "could not read the image size from its header"
+
+
+class InferenceService:
+    """The models, the shared micro-batcher and the request limits behind the API.
+
+    With `workers` > 0 the models live in a WorkerPool instead, and this process
+    only decodes, preprocesses and schedules.
+    """
+
+    def __init__(self, max_images=API_MAX_IMAGES, max_pixels=API_MAX_PIXELS,
+                 max_concurrency=API_MAX_CONCURRENCY, queue_timeout=API_QUEUE_TIMEOUT_S, decode_workers=None,
+                 workers=None):
+        self.workers = resolve_worker_count(INFERENCE_WORKERS) if workers is None else workers
+        self.profile = load_profile(TUNING_PROFILE_PATH)
+        self.max_batch_size = tuned_batch_size(self.profile, BATCH_MAX_SIZE)
+        self.loader = None
+        if not self.workers:
+            self.loader = ModelLoader(
+                lambda: load_inference_model(FIRST_MODEL_PATH), lambda: load_inference_model(SEC_MODEL_PATH),
+                lambda first, sec: build_cascade(first, sec, jit_compile=profile_jit_compile(self.profile),
+                                                 tta_views=TTA_VIEWS),
+                configure=lambda: apply_profile(self.profile),
+            )
+        self.max_images = max_images
+        self.max_pixels = max_pixels
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        # Decoding and resizing release the GIL, so they run off the event loop
+        self.decode_pool = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="api-decode")
+        self.batcher = None
+        self.error = None
+        self._slots = None
+
+    async def start(self, app):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        if self.workers:
+            pool = WorkerPool(self.workers, slots_per_worker=WORKER_RING_SLOTS, max_batch_size=self.max_batch_size,
+                              stall_timeout=WORKER_STALL_TIMEOUT_S, profile=self.profile)
+            while not pool.ready() and pool.error is None:
+                await asyncio.sleep(0.2)
+            if pool.error is not None:
+                self.error = pool.error
+                return
+            self.batcher = pool
+            logger.info("Inference API ready with %d worker processes", self.workers)
+            return
+        try:
+            _, _, cascade = await loop.run_in_executor(None, self.loader.wait)
+        except Exception as e:
+            self.error = f"failed to load models: {e}"
+            return
+
+        def run_batch(batch):
+            with metrics.timed("cascade_batch"):
+                return decode_cascade(run_cascade(cascade, batch))
+
+        self.batcher = MicroBatcher(run_batch, max_batch_size=self.max_batch_size, max_wait_ms=BATCH_MAX_WAIT_MS,
+                                    name="api-micro-batcher")
+        logger.info("Inference API ready")
+
+    def oversized(self, raw):
+        """An error message when the image header reports more pixels than allowed,
+        checked before anything is decoded. An unreadable header is rejected too,
+        since nothing would bound what the decoder then expands it to."""
+        size = source_size(raw)
+        if size is None:
+            return UNREADABLE_HEADER
+        if size[0] * size[1] > self.max_pixels:
+            return f"image has {size[0]}x{size[1]} pixels, the limit is {self.max_pixels}"
+        return None
+
+    @staticmethod
+    def check_quality(image_np):
+        """Rejects the image before inference when OCUSCAN_QUALITY_MODE is "reject"."""
+        report, rejected = gate(image_np)
+        if rejected:
+            return f"image quality too low: {', '.join(report['problems'])}"
+        return None
+
+    async def analyze(self, name, raw):
+        """Returns a batch_score-style record for one image; failures go in "error"."""
+        error = self.oversized(raw)
+        if error is not None:
+            return {"file": name, "error": error}
+        loop = asyncio.get_running_loop()
+        with metrics.timed("api_preprocess"):
+            name, image, error = await loop.run_in_executor(
+                self.decode_pool, load_and_preprocess, name, lambda: raw, self.check_quality)
+        if error is not None:
+            return {"file": name, "error": error}
+        result = await asyncio.wrap_future(self.batcher.submit(image))
+        return to_record(name, result)
+
+    async def acquire(self):
+        """Waits for a free request slot; False once the queue timeout has passed."""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release(self):
+        self._slots.release()
+
+
+# --- Handlers ---
+def _error(status, message):
+    return web.json_response({"error": message}, status=status)
+
+
+class BodyTooLarge(ValueError):
+    """The request body is over the configured size limit."""
+
+
+async def _read_images(request, limit):
+    """(name, bytes) pairs from a multipart form, or the raw body as one image.
+    Stops reading after `limit` + 1 images so the caller can refuse the request.
+
+    aiohttp applies client_max_size only to request.read() and post(), not to a
+    streamed multipart body, so parts are read in chunks against a running
+    total. Raises BodyTooLarge once the limit is passed.
+    """
+    max_bytes = request.app["max_body_bytes"]
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise BodyTooLarge(f"request body is over the {max_bytes}-byte limit")
+    if not request.content_type.startswith("multipart/"):
+        try:
+            return [("image", await request.read())]
+        except web.HTTPRequestEntityTooLarge:
+            raise BodyTooLarge(f"request body is over the {max_bytes}-byte limit") from None
+    images = []
+    total = 0
+    reader = await request.multipart()
+    async for part in reader:
+        if part.filename is None and part.name != "image":
+            continue
+        chunks = []
+        while True:
+            chunk = await part.read_chunk(2**16)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                raise BodyTooLarge(f"request body is over the {max_bytes}-byte limit")
+            chunks.append(chunk)
+        images.append((part.filename or part.name, b"".join(chunks)))
+        if len(images) > limit:
+            break
+    return images
+
+
+def _limited(endpoint):
+    """Applies the concurrency limit and times each request. (A request_trace would
+    mix up requests here: it is thread-local and all handlers share the loop thread.)"""
+    def decorate(handler):
+        async def wrapper(request):
+            service = request.app["service"]
+            if service.batcher is None:
+                return _error(503, service.error or "models are still loading")
+            if not await service.acquire():
+                metrics.inc("ocuscan_api_requests_total", endpoint=endpoint, status="503")
+                return web.json_response({"error": "server busy"}, status=503, headers={"Retry-After": "1"})
+            try:
+                with metrics.timed(f"api_{endpoint}"):
+                    response = await handler(request, service)
+            finally:
+                service.release()
+            metrics.inc("ocuscan_api_requests_total", endpoint=endpoint, status=str(response.status))
+            return response
+        return wrapper
+    return decorate
+
+
+@_limited("analyze")
+async def analyze(request, service):
+    try:
+        images = await _read_images(request, 1)
+    except BodyTooLarge as e:
+        return _error(413, str(e))
+    if not images or not images[0][1]:
+        return _error(400, "no image in request")
+    if len(images) > 1:
+        return _error(400, "send one image, or use /v1/analyze/batch")
+    name, raw = images[0]
+    message = service.oversized(raw)
+    if message is not None:
+        return _error(400 if message == UNREADABLE_HEADER else 413, message)
+    record = await service.analyze(name, raw)
+    if "error" in record:
+        return _error(400, record["error"])
+    return web.json_response(record)
+
+
+@_limited("analyze_batch")
+async def analyze_batch(request, service):
+    if not request.content_type.startswith("multipart/"):
+        return _error(400, "send the images as multipart/form-data file fields")
+    try:
+        images = await _read_images(request, service.max_images)
+    except BodyTooLarge as e:
+        return _error(413, str(e))
+    if not images:
+        return _error(400, "no images in request")
+    if len(images) > service.max_images:
+        return _error(413, f"at most {service.max_images} images per request")
+    # All images of the request are queued together so they can share a batch
+    records = await asyncio.gather(*(service.analyze(name, raw) for name, raw in images))
+    return web.json_response({"results": records})
+
+
+async def health(request):
+    service = request.app["service"]
+    status = "ok" if service.batcher is not None else "failed" if service.error else "loading"
+    body = {"status": status}
+    if service.loader is not None:
+        body["startup_seconds"] = service.loader.timings
+    if service.error:
+        body["error"] = service.error
+    if service.batcher is not None:
+        body["batching"] = service.batcher.stats()
+    return web.json_response(body, status=200 if service.batcher is not None else 503)
+
+
+async def metrics_page(request):
+    return web.Response(text=metrics.registry.render(), content_type="text/plain")
+
+
+def create_app(service=None, max_body_mb=API_MAX_BODY_MB):
+    service = service or InferenceService()
+    # client_max_size only covers bodies read whole; _read_images enforces the
+    # same limit on multipart uploads
+    max_body_bytes = int(max_body_mb * 2**20)
+    app = web.Application(client_max_size=max_body_bytes)
+    app["service"] = service
+    app["max_body_bytes"] = max_body_bytes
+    app.on_startup.append(lambda app: _start_in_background(app, service))
+    app.router.add_post("/v1/analyze", analyze)
+    app.router.add_post("/v1/analyze/batch", analyze_batch)
+    app.router.add_get("/healthz", health)
+    if metrics.enabled():
+        app.router.add_get("/metrics", metrics_page)
+    return app
+
+
+async def _start_in_background(app, service):
+    # Accept connections (and answer /healthz) while the models load
+    app["startup"] = asyncio.create_task(service.start(app))
+
+
+# --- Load test client ---
+async def load_test(url, source, concurrency, total, batch_size):
+    """Sends `total` requests from `concurrency` keep-alive connections and
+    returns latency percentiles, throughput and the count of each status."""
+    images = [(name, read()) for name, read in iter_images(source)]
+    if not images:
+        raise SystemExit(f"No images found in {source}")
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def worker(session):
+        for i in counter:
+            start = time.perf_counter()
+            if batch_size > 1:
+                form = FormData()
+                for j in range(batch_size):
+                    name, raw = images[(i * batch_size + j) % len(images)]
+                    form.add_field("image", raw, filename=name)
+                response = await session.post(f"{url}/v1/analyze/batch", data=form)
+            else:
+                name, raw = images[i % len(images)]
+                response = await session.post(f"{url}/v1/analyze", data=raw,
+                                              headers={"Content-Type": "application/octet-stream"})
+            await response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "images_per_s": len(latencies) * batch_size / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "statuses": statuses,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local HTTP inference API for OcuScanAI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Run the API")
+    serve.add_argument("--host", default=API_HOST)
+    serve.add_argument("--port", type=int, default=API_PORT)
+    serve.add_argument("--workers", default=INFERENCE_WORKERS,
+                       help="Inference worker processes: 'off', 'auto' or a count (default: OCUSCAN_INFERENCE_WORKERS)")
+    client = commands.add_parser("load-test", help="Send images to a running API and report latency")
+    client.add_argument("url", help="e.g. http://127.0.0.1:8600")
+    client.add_argument("source", help="Directory or .zip of images to send")
+    client.add_argument("--concurrency", type=int, default=8)
+    client.add_argument("--requests", type=int, default=200)
+    client.add_argument("--batch-size", type=int, default=1, help="Images per request; above 1 uses /v1/analyze/batch")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.command == "load-test":
+        report = asyncio.run(load_test(args.url.rstrip("/"), args.source, args.concurrency,
+                                       args.requests, args.batch_size))
+        for key, value in report.items():
+            print(f"{key:>14}: {value:.2f}" if isinstance(value, float) else f"{key:>14}: {value}")
+        return 0
+
+    if METRICS_ENABLED:
+        metrics.enable()
+    service = InferenceService(workers=resolve_worker_count(args.workers))
+    web.run_app(create_app(service), host=args.host, port=args.port, keepalive_timeout=API_KEEPALIVE_S)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import base64
+import logging
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# media:  served by Streamlit's media endpoint under a content-hashed URL, so
+#         the page carries a short link and the browser fetches the file once
+# inline: base64 data URI, encoded once per process instead of per result
+# off:    no sound at all
+AUDIO_MODES = ("media", "inline", "off")
+
+
+def _inline_audio_html(audio_bytes):
+    audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+    return f"""
+    <audio autoplay="true">
+        <source src="data:audio/mp3;base64,{audio_b64}" type="audio/mp3">
+        Your browser does not support the audio element.
+    </audio>
+    """
+
+
+class SoundLibrary:
+    """Sound effects read from disk once per process and played by name."""
+
+    def __init__(self, paths, mode="media"):
+        if mode not in AUDIO_MODES:
+            raise ValueError(f"Unknown audio mode '{mode}', expected one of {AUDIO_MODES}")
+        self.mode = mode
+        self.sounds = {}
+        self._inline_html = {}
+        if mode == "off":
+            return
+        for name, path in paths.items():
+            try:
+                with open(path, "rb") as f:
+                    self.sounds[name] = f.read()
+            except OSError as e:
+                logger.warning("Sound '%s' unavailable: %s", name, e)
+                continue
+            if mode == "inline":
+                self._inline_html[name] = _inline_audio_html(self.sounds[name])
+
+    def play(self, name):
+        """Autoplays a preloaded sound; does nothing when sounds are off or missing."""
+        audio_bytes = self.sounds.get(name)
+        if audio_bytes is None:
+            return
+        if self.mode == "inline":
+            st.markdown(self._inline_html[name], unsafe_allow_html=True)
+        else:
+            # The player itself is hidden by the page CSS
+            st.audio(audio_bytes, format="audio/mpeg", autoplay=True)
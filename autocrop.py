@@ -0,0 +1,131 @@
+"""Proposes an eye crop by scoring a grid of candidate windows with the detection model.
+
+Windows have the cropper's 320x280 aspect ratio and come in several sizes. A
+cheap OpenCV pass (edge density plus OpenCV's Haar eye cascade) ranks them, and
+only the best `max_windows` are resized and sent to EyeDetect in one batch.
+"""
+import logging
+
+import numpy as np
+import cv2
+
+from config import MODEL_INPUT_SIZE
+from inference import NO_EYE_INDEX
+
+logger = logging.getLogger(__name__)
+
+# Window sizes as fractions of the largest 320x280 window that fits the image
+DEFAULT_SCALES = (1.0, 0.75, 0.55, 0.4, 0.3)
+# Step between neighbouring windows as a fraction of the window size
+DEFAULT_STRIDE = 0.25
+# Within this much of the best eye probability, the tighter window wins
+TIE_MARGIN = 0.02
+
+_eye_cascade = None
+
+
+def window_grid(image_shape, scales=DEFAULT_SCALES, stride=DEFAULT_STRIDE, aspect=MODEL_INPUT_SIZE):
+    """All candidate windows as an (N, 4) int array of (left, top, right, bottom)."""
+    height, width = image_shape[:2]
+    base_width = min(width, height * aspect[0] / aspect[1])
+    boxes = []
+    for scale in scales:
+        box_width = int(base_width * scale)
+        box_height = int(box_width * aspect[1] / aspect[0])
+        if box_width < 16 or box_height < 16:
+            continue
+        lefts = _positions(width, box_width, max(1, int(box_width * stride)))
+        tops = _positions(height, box_height, max(1, int(box_height * stride)))
+        left, top = np.meshgrid(lefts, tops)
+        left, top = left.ravel(), top.ravel()
+        boxes.append(np.stack([left, top, left + box_width, top + box_height], axis=1))
+    if not boxes:
+        return np.zeros((0, 4), dtype=np.int64)
+    return np.concatenate(boxes)
+
+
+def _positions(length, size, step):
+    """Evenly stepped offsets that always include the far edge."""
+    positions = np.arange(0, length - size + 1, step)
+    if positions[-1] != length - size:
+        positions = np.append(positions, length - size)
+    return positions
+
+
+def _haar_eye_cascade():
+    global _eye_cascade
+    if _eye_cascade is None:
+        _eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye.xml")
+    return _eye_cascade
+
+
+def prefilter_scores(image_np, boxes):
+    """Cheap per-window score: mean gradient magnitude (from an integral image),
+    plus a bonus for windows that contain a Haar eye detection of a plausible size."""
+    gray = cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
+    gradient = cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0), cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+    integral = cv2.integral(gradient, sdepth=cv2.CV_64F)
+    left, top, right, bottom = boxes.T
+    sums = integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
+    scores = sums / ((right - left) * (bottom - top))
+    scores = scores / max(scores.max(), 1e-6)
+
+    cascade = _haar_eye_cascade()
+    if cascade.empty():
+        return scores
+    eyes = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4)
+    for ex, ey, ew, eh in eyes:
+        cx, cy = ex + ew / 2, ey + eh / 2
+        inside = (left <= cx) & (cx < right) & (top <= cy) & (cy < bottom)
+        # An eye should fill a fair part of the crop, not be a speck in it
+        fits = (right - left) <= ew * 6
+        scores = scores + (inside & fits)
+    return scores
+
+
+def window_batch(image_np, boxes, target_size=MODEL_INPUT_SIZE):
+    """Crops and resizes every window into one float32 RGB batch, like `preprocess_image`."""
+    width, height = target_size
+    batch = np.empty((len(boxes), height, width, 3), dtype=np.float32)
+    for i, (left, top, right, bottom) in enumerate(boxes):
+        window = cv2.resize(image_np[top:bottom, left:right], target_size, interpolation=cv2.INTER_AREA)
+        batch[i] = cv2.cvtColor(window, cv2.COLOR_BGR2RGB)
+    return batch
+
+
+def propose_crop(image_np, first_model, max_windows=32, scales=DEFAULT_SCALES, stride=DEFAULT_STRIDE):
+    """Finds the window most likely to frame an eye.
+
+    Returns {"box": {"left", "top", "width", "height"}, "confidence", "windows"}
+    in `image_np` pixels, or None when the image is too small to search.
+    """
+    boxes = window_grid(image_np.shape, scales, stride)
+    if len(boxes) == 0:
+        return None
+    if max_windows and len(boxes) > max_windows:
+        boxes = boxes[np.argsort(-prefilter_scores(image_np, boxes), kind="stable")[:max_windows]]
+
+    predictions = np.asarray(first_model.predict(window_batch(image_np, boxes), verbose=0))
+    eye_probability = 1.0 - predictions[:, NO_EYE_INDEX]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    candidates = np.flatnonzero(eye_probability >= eye_probability.max() - TIE_MARGIN)
+    best = candidates[np.argmin(areas[candidates])]
+
+    left, top, right, bottom = (int(v) for v in boxes[best])
+    logger.debug("Auto-crop scored %d windows, best %.3f at %s", len(boxes), eye_probability[best], boxes[best])
+    return {
+        "box": {"left": left, "top": top, "width": right - left, "height": bottom - top},
+        "confidence": float(eye_probability[best]),
+        "windows": len(boxes),
+    }
+
+
+def cropper_box_algorithm(box, image_shape):
+    """A `box_algorithm` for st_cropper that places its box on `box`, given in
+    pixels of an image shaped `image_shape`, whatever size the cropper shows it at."""
+    def box_algorithm(img, aspect_ratio=None):
+        scale_x = img.width / image_shape[1]
+        scale_y = img.height / image_shape[0]
+        return {"left": int(box["left"] * scale_x), "top": int(box["top"] * scale_y),
+                "width": int(box["width"] * scale_x), "height": int(box["height"] * scale_y)}
+    return box_algorithm
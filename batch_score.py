@@ -0,0 +1,250 @@
+"""Headless batch scoring of eye images.
+
+Streams every JPG/PNG in a folder or a .zip archive through the same
+preprocessing, models and thresholds as the Streamlit app and writes one
+record per image.
+
+    python batch_score.py images/ --output results.jsonl
+    python batch_score.py archive.zip --output results.csv --format csv --resume
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import cv2
+
+from config import TTA_VIEWS
+from inference import fit_to_model, load_models, build_cascade, run_cascade, decode_cascade, final_label
+
+logger = logging.getLogger("batch_score")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+FIELDS = ["file", "result", "eye_label", "eye_confidence", "condition_label", "condition_confidence", "error"]
+
+
+# --- Sources ---
+def iter_images(source):
+    """Yields (name, read_bytes) for every image in a directory or zip archive,
+    in a stable order so runs can be resumed."""
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        lock = threading.Lock()
+
+        def reader(name):
+            def read():
+                with lock:
+                    return archive.read(name)
+            return read
+
+        for name in sorted(archive.namelist()):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield name, reader(name)
+        return
+
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, source)
+                yield name, partial(read_file, path)
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def load_and_preprocess(name, read, check=None):
+    """Decodes one image and returns (name, crop at model input size) or (name, error).
+
+    `check`, if given, sees the decoded image first; an error message it returns
+    is reported like a decode failure.
+    """
+    try:
+        image_np = cv2.imdecode(np.frombuffer(read(), np.uint8), cv2.IMREAD_COLOR)
+        if image_np is None:
+            return name, None, "could not decode image"
+        error = check(image_np) if check is not None else None
+        if error is not None:
+            return name, None, error
+        return name, fit_to_model(image_np), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+# --- Output ---
+def drop_torn_tail(output_path, chunk_size=65536):
+    """Truncates the file after its last complete line, so records appended on
+    resume start on a line of their own. Returns the number of bytes dropped."""
+    if not os.path.exists(output_path):
+        return 0
+    with open(output_path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - chunk_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            f.truncate(end)
+        return size - end
+
+
+def already_scored(output_path, fmt):
+    """Names already present in an earlier output file (the resume checkpoint)."""
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, newline="") as f:
+        if fmt == "csv":
+            return {row["file"] for row in csv.DictReader(f)}
+        done = set()
+        for line in f:
+            try:
+                done.add(json.loads(line)["file"])
+            except (ValueError, KeyError):
+                continue
+        return done
+
+
+class ResultWriter:
+    """Appends records to a JSONL or CSV file, flushing after every batch."""
+
+    def __init__(self, output_path, fmt):
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.file = open(output_path, "a", newline="")
+        self.fmt = fmt
+        if fmt == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+            if is_new:
+                self.writer.writeheader()
+
+    def write(self, record):
+        if self.fmt == "csv":
+            self.writer.writerow({field: record.get(field, "") for field in FIELDS})
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def to_record(name, result):
+    return {
+        "file": name,
+        "result": final_label(result),
+        "eye_label": result["eye_label"],
+        "eye_confidence": round(float(result["eye_confidence"]), 6),
+        "condition_label": result["condition_label"],
+        "condition_confidence": round(float(result["condition_confidence"]), 6),
+    }
+
+
+# --- Pipeline ---
+def score(source, output_path, fmt="jsonl", batch_size=32, workers=None, resume=False, log_every=10):
+    """Scores every image under `source`; returns (scored, failed, seconds)."""
+    workers = workers or os.cpu_count() or 1
+    if resume:
+        # A torn last line from an interrupted run is dropped and that image scored again
+        dropped = drop_torn_tail(output_path)
+        if dropped:
+            logger.info("Resuming: dropped a torn %d-byte record at the end of %s", dropped, output_path)
+    done = already_scored(output_path, fmt) if resume else set()
+    if not resume and os.path.exists(output_path):
+        os.remove(output_path)
+    if done:
+        logger.info("Resuming: %d image(s) already scored", len(done))
+
+    first_model, sec_model = load_models()
+    cascade = build_cascade(first_model, sec_model, tta_views=TTA_VIEWS)
+    writer = ResultWriter(output_path, fmt)
+
+    # Only this many decoded images are held in memory at once
+    max_in_flight = batch_size + 2 * workers
+    in_flight = deque()
+    names, images = [], []
+    scored = failed = batches = 0
+    start = time.perf_counter()
+
+    def flush_batch():
+        nonlocal scored, batches
+        results = decode_cascade(run_cascade(cascade, np.stack(images)))
+        for name, result in zip(names, results):
+            writer.write(to_record(name, result))
+        writer.flush()
+        scored += len(names)
+        batches += 1
+        names.clear()
+        images.clear()
+        if batches % log_every == 0:
+            elapsed = time.perf_counter() - start
+            logger.info("%d scored, %d failed, %.1f images/sec", scored, failed, scored / elapsed)
+
+    def drain_one():
+        nonlocal failed
+        name, image, error = in_flight.popleft().result()
+        if error is not None:
+            writer.write({"file": name, "error": error})
+            failed += 1
+            return
+        names.append(name)
+        images.append(image)
+        if len(images) >= batch_size:
+            flush_batch()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for name, read in iter_images(source):
+                if name in done:
+                    continue
+                in_flight.append(pool.submit(load_and_preprocess, name, read))
+                if len(in_flight) >= max_in_flight:
+                    drain_one()
+            while in_flight:
+                drain_one()
+            if images:
+                flush_batch()
+    finally:
+        writer.flush()
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    return scored, failed, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a folder or zip of eye images without the UI.")
+    parser.add_argument("source", help="Directory or .zip archive of JPG/PNG images")
+    parser.add_argument("--output", "-o", default="results.jsonl", help="Output file (default: results.jsonl)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Output format (default: from the output extension)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per forward pass (default: 32)")
+    parser.add_argument("--workers", type=int, default=None, help="Decode threads (default: CPU count)")
+    parser.add_argument("--resume", action="store_true", help="Skip images already present in the output file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    fmt = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    scored, failed, elapsed = score(args.source, args.output, fmt, args.batch_size, args.workers, args.resume)
+    rate = scored / elapsed if elapsed else 0.0
+    logger.info("Done: %d scored, %d failed in %.1fs (%.1f images/sec)", scored, failed, elapsed, rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Process-wide scheduler that groups single-image requests into batches.
+
+    Callers from any session thread `submit` one preprocessed image (without the
+    batch dimension). A background thread waits up to `max_wait_ms` for more
+    requests, stacks at most `max_batch_size` of them, calls `run_batch` once and
+    hands each caller its own row of the result.
+
+    `run_batch` receives a stacked numpy batch and must return a sequence with
+    one result per image, in order.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, name="micro-batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._largest_batch = 0
+        self._batch_sizes = {}
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """Queues one image and returns a Future for its result."""
+        future = Future()
+        self._queue.put((image, future))
+        return future
+
+    def predict(self, image, timeout=None):
+        """Queues one image and blocks until its result is ready."""
+        return self.submit(image).result(timeout)
+
+    def stats(self):
+        """Returns queue depth and batch-size statistics."""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "requests": self._requests,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "batch_size_counts": dict(self._batch_sizes),
+            }
+
+    def _collect(self):
+        """Blocks for the first request, then gathers more until the batch is full
+        or the wait window closes."""
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    pending.append(self._queue.get_nowait())
+                else:
+                    pending.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return pending
+
+    def _loop(self):
+        while True:
+            pending = self._collect()
+            # Skip requests whose caller already gave up
+            pending = [(image, future) for image, future in pending if future.set_running_or_notify_cancel()]
+            if not pending:
+                continue
+            try:
+                results = self.run_batch(np.stack([image for image, _ in pending]))
+            except Exception as e:
+                logger.exception("Batched inference failed for %d request(s)", len(pending))
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+            self._record(len(pending))
+
+    def _record(self, size):
+        with self._lock:
+            self._batches += 1
+            self._requests += size
+            self._largest_batch = max(self._largest_batch, size)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+        logger.debug("Ran batch of %d, queue depth %d", size, self._queue.qsize())
@@ -0,0 +1,326 @@
+"""Latency, throughput and memory benchmarks for the preprocessing and inference hot paths.
+
+    python benchmark.py run --save baseline.json
+    python benchmark.py run --stand-in --iterations 20
+    python benchmark.py compare baseline.json --threshold 0.15
+    python benchmark.py parity --stand-in
+
+`run` times every stage on synthetic images at several resolutions and prints
+p50/p95/p99 latency, throughput and peak RSS per stage; `--save` stores the
+results as a JSON baseline. `compare` runs the same stages and exits non-zero
+when any stage's p50 or p95 is more than `--threshold` slower than the baseline.
+`parity` checks that the cascade's in-graph preprocessing matches
+`preprocess_image`, colour order included; `run` and `compare` check it too and
+fail when it does not.
+
+`--stand-in` replaces the .keras files with small untrained models that have the
+same input and output shapes, so the suite runs anywhere.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+import numpy as np
+import cv2
+
+from config import MODEL_INPUT_SIZE, FIRST_CLASS_NAMES, SEC_CLASS_NAMES
+from inference import (
+    preprocess_image, fit_to_model, graph_preprocess, detection_label, condition_label, load_models,
+    build_cascade, run_cascade,
+)
+from imaging import decode_proxy, decode_source, map_box, crop_box
+from tta import augment_views, average_predictions
+
+DEFAULT_RESOLUTIONS = ["640x480", "1920x1080", "4032x3024"]
+
+
+# --- Measurement ---
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # ru_maxrss is already a peak; kilobytes on Linux, bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakRSS:
+    """Samples resident memory on a background thread while a stage runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+
+def measure(fn, iterations, warmup=3, items_per_call=1):
+    """Times `fn` and returns latency percentiles, throughput and peak RSS."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    with PeakRSS() as rss:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "iterations": iterations,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+        "throughput_per_s": float(items_per_call * 1000 / latencies_ms.mean()),
+        "peak_rss_mb": rss.peak / 2**20,
+    }
+
+
+# --- Inputs ---
+def synthetic_image(width, height, seed=0):
+    """A smooth random BGR image; pure noise would make JPEG sizes unrealistic."""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+
+
+def default_box(image_shape):
+    """A centred crop with the cropper's 320x280 aspect ratio covering 60% of the width."""
+    height, width = image_shape[:2]
+    box_width = int(width * 0.6)
+    box_height = min(height, int(box_width * MODEL_INPUT_SIZE[1] / MODEL_INPUT_SIZE[0]))
+    return {"left": (width - box_width) // 2, "top": (height - box_height) // 2,
+            "width": box_width, "height": box_height}
+
+
+def stand_in_models():
+    """Small untrained models with the real models' input and output shapes."""
+    import keras
+    width, height = MODEL_INPUT_SIZE
+
+    def build(num_classes):
+        inputs = keras.Input((height, width, 3))
+        x = keras.layers.Rescaling(1 / 255.0)(inputs)
+        x = keras.layers.Conv2D(16, 3, strides=2, activation="relu")(x)
+        x = keras.layers.Conv2D(32, 3, strides=2, activation="relu")(x)
+        x = keras.layers.GlobalAveragePooling2D()(x)
+        return keras.Model(inputs, keras.layers.Dense(num_classes, activation="softmax")(x))
+
+    return build(len(FIRST_CLASS_NAMES)), build(len(SEC_CLASS_NAMES))
+
+
+# --- Preprocessing parity ---
+def preprocessing_parity(first_model, sec_model, sizes=((640, 560), (320, 280), (200, 175)), seed=0):
+    """Compares the cascade, which preprocesses uint8 BGR crops in the graph,
+    with the models called on `preprocess_image` output.
+
+    Returns the largest pixel and probability differences and whether a pure
+    blue BGR crop reaches the models as blue RGB. With the colour order wrong
+    the pixel difference is a large fraction of 255, not about one level.
+    """
+    cascade = build_cascade(first_model, sec_model)
+    pixel_delta = probability_delta = 0.0
+    for i, (width, height) in enumerate(sizes):
+        crop = synthetic_image(width, height, seed=seed + i)
+        host = preprocess_image(crop)
+        graph = np.asarray(graph_preprocess(crop[np.newaxis]))
+        pixel_delta = max(pixel_delta, float(np.abs(graph - host).max()))
+        outputs = run_cascade(cascade, crop)
+        for model, key in ((first_model, "detection"), (sec_model, "condition")):
+            expected = model.predict(host, verbose=0)
+            probability_delta = max(probability_delta, float(np.abs(outputs[key] - expected).max()))
+    blue = np.zeros((280, 320, 3), dtype=np.uint8)
+    blue[..., 0] = 255
+    blue_rgb = np.asarray(graph_preprocess(blue[np.newaxis]))[0, 0, 0]
+    return {
+        "max_pixel_delta": pixel_delta,
+        "max_probability_delta": probability_delta,
+        "bgr_to_rgb": bool(blue_rgb[2] == 255 and blue_rgb[0] == 0),
+    }
+
+
+def parity_failures(report, max_pixel_delta=1.0, max_probability_delta=0.01):
+    failures = []
+    if not report["bgr_to_rgb"]:
+        failures.append("in-graph preprocessing does not convert BGR to RGB")
+    if report["max_pixel_delta"] > max_pixel_delta:
+        failures.append(f"pixels differ by up to {report['max_pixel_delta']:.2f} levels")
+    if report["max_probability_delta"] > max_probability_delta:
+        failures.append(f"probabilities differ by up to {report['max_probability_delta']:.4f}")
+    return failures
+
+
+# --- Suite ---
+def suite_models(stand_in):
+    return stand_in_models() if stand_in else load_models()
+
+
+def run_suite(resolutions, iterations, stand_in=False, batch_size=8, tta_views=8, models=None):
+    results = {}
+
+    for resolution in resolutions:
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        image = synthetic_image(width, height)
+        raw = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+        box = default_box(image.shape)
+        crop = crop_box(image, map_box(box, image.shape, image.shape))
+
+        def decode_and_crop():
+            decoded = decode_source(raw)
+            return crop_box(decoded, map_box(box, decoded.shape, decoded.shape))
+
+        results[f"decode_crop@{resolution}"] = measure(decode_and_crop, iterations)
+        results[f"decode_proxy@{resolution}"] = measure(lambda: decode_proxy(raw), iterations)
+        results[f"preprocess_image@{resolution}"] = measure(lambda: preprocess_image(crop), iterations)
+
+    first_model, sec_model = models or suite_models(stand_in)
+    cascade = build_cascade(first_model, sec_model)
+    crop = synthetic_image(640, 560)
+    single = preprocess_image(crop)
+    fitted = fit_to_model(crop)
+    batch = np.repeat(fitted[np.newaxis], batch_size, axis=0)
+
+    results["predict_eye_detection"] = measure(
+        lambda: detection_label(first_model.predict(preprocess_image(crop), verbose=0)[0]), iterations)
+    results["predict_eye_condition"] = measure(
+        lambda: condition_label(sec_model.predict(preprocess_image(crop), verbose=0)[0]), iterations)
+    # Compare with predict_eye_condition for the latency test-time augmentation adds
+    results[f"tta_augment@{tta_views}"] = measure(lambda: augment_views(single, tta_views), iterations)
+    results[f"predict_eye_condition_tta@{tta_views}"] = measure(
+        lambda: condition_label(average_predictions(
+            sec_model.predict(augment_views(preprocess_image(crop), tta_views), verbose=0))), iterations)
+    results["cascade@batch1"] = measure(lambda: run_cascade(cascade, fitted), iterations)
+    # A crop of another size, resized inside the graph
+    results["cascade_any_size@batch1"] = measure(lambda: run_cascade(cascade, crop), iterations)
+    results[f"cascade@batch{batch_size}"] = measure(
+        lambda: run_cascade(cascade, batch), iterations, items_per_call=batch_size)
+    tta_cascade = build_cascade(first_model, sec_model, tta_views=tta_views)
+    results[f"cascade_tta{tta_views}@batch1"] = measure(lambda: run_cascade(tta_cascade, fitted), iterations)
+    return results
+
+
+def environment(stand_in):
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "models": "stand-in" if stand_in else "keras files",
+    }
+    try:
+        import tensorflow as tf
+        info["tensorflow"] = tf.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def print_table(results):
+    print(f"{'stage':<34}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per sec':>10}{'peak MB':>10}")
+    for stage, r in results.items():
+        print(f"{stage:<34}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['throughput_per_s']:>10.1f}{r['peak_rss_mb']:>10.0f}")
+
+
+def compare(baseline, current, threshold):
+    """Returns a list of (stage, metric, baseline, current) regressions."""
+    regressions = []
+    for stage, base in baseline["stages"].items():
+        now = current.get(stage)
+        if now is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if now[metric] > base[metric] * (1 + threshold):
+                regressions.append((stage, metric, base[metric], now[metric]))
+    return regressions
+
+
+def check_parity(models):
+    """Prints the parity report; returns 1 when preprocessing has drifted."""
+    report = preprocessing_parity(*models)
+    print(f"Preprocessing parity: pixels {report['max_pixel_delta']:.2f} levels, "
+          f"probabilities {report['max_probability_delta']:.5f}, BGR->RGB {'ok' if report['bgr_to_rgb'] else 'WRONG'}")
+    failures = parity_failures(report)
+    for failure in failures:
+        print(f"PARITY {failure}")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing and inference stages.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    parity_parser = commands.add_parser("parity", help="Check in-graph preprocessing against preprocess_image")
+    parity_parser.add_argument("--stand-in", action="store_true", help="Use small stand-in models instead of the .keras files")
+    for name in ("run", "compare"):
+        sub = commands.add_parser(name)
+        if name == "compare":
+            sub.add_argument("baseline", help="JSON file written by 'run --save'")
+            sub.add_argument("--threshold", type=float, default=0.15,
+                             help="Allowed slowdown as a fraction (default: 0.15)")
+        else:
+            sub.add_argument("--save", help="Write the results to this JSON baseline")
+        sub.add_argument("--stand-in", action="store_true", help="Use small stand-in models instead of the .keras files")
+        sub.add_argument("--iterations", type=int, default=50)
+        sub.add_argument("--batch-size", type=int, default=8)
+        sub.add_argument("--tta-views", type=int, default=8, help="Augmented views in the TTA stages (default: 8)")
+        sub.add_argument("--resolutions", nargs="+", default=None,
+                         help=f"Synthetic image sizes, WIDTHxHEIGHT (default: {' '.join(DEFAULT_RESOLUTIONS)})")
+    args = parser.parse_args(argv)
+
+    if args.command == "parity":
+        return check_parity(suite_models(args.stand_in))
+
+    baseline = None
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    # A comparison uses the baseline's own setup unless told otherwise
+    resolutions = args.resolutions or (baseline or {}).get("resolutions") or DEFAULT_RESOLUTIONS
+    stand_in = args.stand_in or (baseline is not None and baseline["environment"]["models"] == "stand-in")
+
+    models = suite_models(stand_in)
+    if check_parity(models):
+        return 1
+    results = run_suite(resolutions, args.iterations, stand_in, args.batch_size, args.tta_views, models)
+    print_table(results)
+
+    if args.command == "run":
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump({"environment": environment(stand_in), "resolutions": resolutions,
+                           "stages": results}, f, indent=2)
+            print(f"Baseline written to {args.save}")
+        return 0
+
+    regressions = compare(baseline, results, args.threshold)
+    for stage, metric, before, after in regressions:
+        print(f"REGRESSION {stage} {metric}: {before:.2f} -> {after:.2f} ms ({after / before - 1:+.0%})")
+    if regressions:
+        return 1
+    print(f"No stage regressed by more than {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
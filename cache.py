@@ -0,0 +1,81 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def model_identity(*paths):
+    """Fingerprint of the model files on disk (path, size and modification time),
+    so cached results are dropped when a model file is replaced."""
+    parts = []
+    for path in paths:
+        try:
+            info = os.stat(path)
+            parts.append(f"{os.path.abspath(path)}:{info.st_size}:{info.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{os.path.abspath(path)}:missing")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """Thread-safe LRU cache of analysis results keyed by crop content.
+
+    Entries expire after `ttl_seconds` and the least recently used entry is
+    evicted once `max_entries` is reached. A `max_entries` of 0 disables the cache.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600.0, namespace=""):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.namespace = namespace
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key_for(self, image_np):
+        """Hashes the crop pixels together with their shape and the model identity."""
+        digest = hashlib.sha256(self.namespace.encode("utf-8"))
+        digest.update(f"{image_np.shape}:{image_np.dtype}".encode("utf-8"))
+        digest.update(np.ascontiguousarray(image_np))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns the cached result or None, counting the hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,128 @@
+import os
+
+# --- Models ---
+FIRST_MODEL_PATH = "EyeDetect.keras"
+FIRST_CLASS_NAMES = ["Eye Detected", "No Eye Detected"]
+SEC_MODEL_PATH = "EyeAnalysis.keras"
+SEC_CLASS_NAMES = ["Healthy", "Pinguecula", "Pterygium Stage 1 (Trace-Mild)", "Pterygium Stage 2 (Moderate-Severe)", "Red Eye(Conjunctivitis)"]
+# เพิ่ม path ของไฟล์เสียง
+EFFECT_SOUND_PATH = "good-6081.mp3"
+PLOP_SOUND_PATH = "plop-2.mp3"
+
+# Model input size as (width, height), the order cv2.resize expects
+MODEL_INPUT_SIZE = (320, 280)
+
+# Thresholds
+CONFIDENCE_THRESHOLD = 0.60
+MARGIN_THRESHOLD = 0.10
+
+
+# --- Deployment settings (overridable through environment variables) ---
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_str(name, default):
+    value = os.environ.get(name)
+    return value if value not in (None, "") else default
+
+
+# Cross-session micro-batching of inference requests
+BATCH_MAX_SIZE = env_int("OCUSCAN_BATCH_MAX_SIZE", 8)
+BATCH_MAX_WAIT_MS = env_float("OCUSCAN_BATCH_MAX_WAIT_MS", 5.0)
+
+# Content-addressed cache of analysis results (0 entries disables it)
+PREDICTION_CACHE_SIZE = env_int("OCUSCAN_CACHE_SIZE", 256)
+PREDICTION_CACHE_TTL_S = env_float("OCUSCAN_CACHE_TTL_S", 3600.0)
+
+# How sound effects reach the browser: "media", "inline" or "off"
+AUDIO_MODE = env_str("OCUSCAN_AUDIO_MODE", "media")
+
+# Full-resolution decodes kept for mapping crops back to source pixels
+SOURCE_CACHE_ENTRIES = env_int("OCUSCAN_SOURCE_CACHE_ENTRIES", 8)
+
+# Inference backend: "keras" runs the .keras files, "tflite" runs the
+# <model>.<variant>.tflite files written by tflite_tools.py
+INFERENCE_BACKEND = env_str("OCUSCAN_BACKEND", "keras")
+TFLITE_VARIANT = env_str("OCUSCAN_TFLITE_VARIANT", "int8")
+TFLITE_THREADS = env_int("OCUSCAN_TFLITE_THREADS", None)
+
+# Stage timers, counters and a Prometheus /metrics endpoint (off by default)
+METRICS_ENABLED = env_bool("OCUSCAN_METRICS", False)
+METRICS_PORT = env_int("OCUSCAN_METRICS_PORT", 9464)
+METRICS_HOST = env_str("OCUSCAN_METRICS_HOST", "127.0.0.1")
+
+# How the two models run per analysis: "cascade" (fused graph, micro-batched),
+# "speculative" (both at once, condition dropped when no eye) or "serial"
+EXECUTION_MODE = env_str("OCUSCAN_EXECUTION_MODE", "cascade")
+SPECULATIVE_WORKERS = env_int("OCUSCAN_SPECULATIVE_WORKERS", 4)
+
+# Per-session crops are kept at model input size in a memory-bounded store;
+# idle or least recently used sessions lose their images first
+SESSION_IMAGE_BUDGET_MB = env_float("OCUSCAN_SESSION_IMAGE_BUDGET_MB", 2.0)
+GLOBAL_IMAGE_BUDGET_MB = env_float("OCUSCAN_GLOBAL_IMAGE_BUDGET_MB", 256.0)
+SESSION_IDLE_TTL_S = env_float("OCUSCAN_SESSION_IDLE_TTL_S", 1800.0)
+
+# Automatic eye localization: the cropper starts on the best-scoring window, and
+# above AUTOCROP_SKIP_CONFIDENCE the crop is used without manual adjustment
+AUTOCROP_ENABLED = env_bool("OCUSCAN_AUTOCROP", True)
+AUTOCROP_MAX_WINDOWS = env_int("OCUSCAN_AUTOCROP_MAX_WINDOWS", 32)
+AUTOCROP_SKIP_CONFIDENCE = env_float("OCUSCAN_AUTOCROP_SKIP_CONFIDENCE", 0.90)
+
+# Test-time augmentation for the condition model: number of augmented views
+# scored in one batch and averaged (1 turns it off, at most 12)
+TTA_VIEWS = env_int("OCUSCAN_TTA_VIEWS", 1)
+
+# Local HTTP inference API (api_server.py): request size and concurrency limits
+API_HOST = env_str("OCUSCAN_API_HOST", "127.0.0.1")
+API_PORT = env_int("OCUSCAN_API_PORT", 8600)
+API_MAX_BODY_MB = env_float("OCUSCAN_API_MAX_BODY_MB", 32.0)
+API_MAX_IMAGES = env_int("OCUSCAN_API_MAX_IMAGES", 16)
+API_MAX_PIXELS = env_int("OCUSCAN_API_MAX_PIXELS", 40_000_000)
+API_MAX_CONCURRENCY = env_int("OCUSCAN_API_MAX_CONCURRENCY", 64)
+API_QUEUE_TIMEOUT_S = env_float("OCUSCAN_API_QUEUE_TIMEOUT_S", 10.0)
+API_KEEPALIVE_S = env_float("OCUSCAN_API_KEEPALIVE_S", 75.0)
+
+# Out-of-process inference: "off", "auto" (one process per two cores) or a
+# count. Each worker gets a shared-memory ring of WORKER_RING_SLOTS crops.
+# With workers the UI and API never load the models themselves, so the
+# execution mode is always "cascade" and auto-crop is off
+INFERENCE_WORKERS = env_str("OCUSCAN_INFERENCE_WORKERS", "off")
+WORKER_RING_SLOTS = env_int("OCUSCAN_WORKER_RING_SLOTS", 16)
+WORKER_STALL_TIMEOUT_S = env_float("OCUSCAN_WORKER_STALL_TIMEOUT_S", 60.0)
+
+# CPU tuning profile written by 'python tuning.py tune'; applied at startup when present.
+# Inference workers each apply it, with its thread counts capped at their share of the cores
+TUNING_PROFILE_PATH = env_str("OCUSCAN_TUNING_PROFILE", "tuning_profile.json")
+
+# Video mode: sampling rate, frame cap and the sharpness / near-duplicate
+# limits below which a sampled frame is skipped
+VIDEO_SAMPLE_FPS = env_float("OCUSCAN_VIDEO_SAMPLE_FPS", 4.0)
+VIDEO_MAX_FRAMES = env_int("OCUSCAN_VIDEO_MAX_FRAMES", 48)
+VIDEO_MIN_SHARPNESS = env_float("OCUSCAN_VIDEO_MIN_SHARPNESS", 30.0)
+VIDEO_DUPLICATE_THRESHOLD = env_float("OCUSCAN_VIDEO_DUPLICATE_THRESHOLD", 4.0)
+VIDEO_BATCH_SIZE = env_int("OCUSCAN_VIDEO_BATCH_SIZE", 16)
+
+# Quality gate before any model call: "reject" stops blurry, badly exposed or
+# tiny crops, "warn" analyzes them with a notice, "off" skips the checks.
+# Sharpness is the Laplacian variance of a copy at most 256 px wide; brightness
+# is the mean grey level and "clipped" the share of pure black or white pixels
+QUALITY_MODE = env_str("OCUSCAN_QUALITY_MODE", "warn")
+QUALITY_MIN_SIDE = env_int("OCUSCAN_QUALITY_MIN_SIDE", 64)
+QUALITY_MIN_SHARPNESS = env_float("OCUSCAN_QUALITY_MIN_SHARPNESS", 25.0)
+QUALITY_MIN_BRIGHTNESS = env_float("OCUSCAN_QUALITY_MIN_BRIGHTNESS", 40.0)
+QUALITY_MAX_BRIGHTNESS = env_float("OCUSCAN_QUALITY_MAX_BRIGHTNESS", 220.0)
+QUALITY_MAX_CLIPPED = env_float("OCUSCAN_QUALITY_MAX_CLIPPED", 0.4)
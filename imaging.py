@@ -0,0 +1,111 @@
+import hashlib
+import io
+
+import numpy as np
+import cv2
+from PIL import Image
+
+# streamlit-cropper never displays more than 700 px on a side, so a larger
+# proxy would only be shrunk again on every rerun
+CROPPER_MAX_SIDE = 700
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+# EXIF orientations that rotate the image by 90 or 270 degrees
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def upload_digest(raw_bytes):
+    """Stable identifier for an uploaded file."""
+    return hashlib.sha256(raw_bytes).hexdigest()
+
+
+def _open_header(raw_bytes):
+    """Opens the image lazily, reading only its header, or returns None.
+
+    Goes through Pillow's format plugins directly rather than Image.open, which
+    refuses anything over Image.MAX_IMAGE_PIXELS before the size can be read.
+    Here the size is the whole point: the callers decide how much is too much.
+    """
+    Image.init()
+    prefix = raw_bytes[:16]
+    for fmt in Image.ID:
+        factory, accept = Image.OPEN[fmt]
+        if accept is not None:
+            accepted = accept(prefix)
+            # a string is Pillow's "recognised but unsupported" message
+            if not accepted or isinstance(accepted, str):
+                continue
+        try:
+            return factory(io.BytesIO(raw_bytes), "")
+        except Exception:
+            continue
+    return None
+
+
+def source_size(raw_bytes):
+    """Returns the (width, height) the image will have once decoded, reading only
+    the file header. None if the header cannot be parsed."""
+    img = _open_header(raw_bytes)
+    if img is None:
+        return None
+    with img:
+        width, height = img.size
+        # cv2.imdecode applies the EXIF rotation, PIL's size does not
+        try:
+            orientation = img.getexif().get(0x0112)
+        except Exception:
+            orientation = None
+        if orientation in _TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        return width, height
+
+
+def decode_source(raw_bytes):
+    """Decodes the upload at full resolution (BGR)."""
+    return cv2.imdecode(np.frombuffer(raw_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+def decode_proxy(raw_bytes, max_side=CROPPER_MAX_SIDE):
+    """Decodes a BGR copy no larger than `max_side` on its long edge.
+
+    JPEGs are decoded straight at 1/2, 1/4 or 1/8 scale by libjpeg, so a 12 MP
+    photo never has to be expanded to full size just to be shown in the cropper.
+    """
+    size = source_size(raw_bytes)
+    factor = 1
+    if size is not None:
+        long_side = max(size)
+        while factor < 8 and long_side / (factor * 2) >= max_side:
+            factor *= 2
+    image = cv2.imdecode(np.frombuffer(raw_bytes, np.uint8), _REDUCED_FLAGS[factor])
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return image
+
+
+def map_box(box, proxy_shape, source_shape):
+    """Scales a cropper box (left/top/width/height on the proxy) to source pixel
+    coordinates, clamped to the source bounds."""
+    scale_x = source_shape[1] / proxy_shape[1]
+    scale_y = source_shape[0] / proxy_shape[0]
+    left = min(max(0, round(box["left"] * scale_x)), source_shape[1] - 1)
+    top = min(max(0, round(box["top"] * scale_y)), source_shape[0] - 1)
+    right = min(source_shape[1], max(left + 1, round((box["left"] + box["width"]) * scale_x)))
+    bottom = min(source_shape[0], max(top + 1, round((box["top"] + box["height"]) * scale_y)))
+    return left, top, right, bottom
+
+
+def crop_box(image_np, box):
+    """Returns a copy of `image_np` inside a (left, top, right, bottom) box."""
+    left, top, right, bottom = box
+    return image_np[top:bottom, left:right].copy()
@@ -0,0 +1,294 @@
+import os
+import threading
+
+import numpy as np
+import cv2
+# TensorFlow itself is imported inside the functions that need it, so the UI
+# can render while it loads in the background (see model_loader.py)
+
+from config import (
+    FIRST_MODEL_PATH, FIRST_CLASS_NAMES, SEC_MODEL_PATH, SEC_CLASS_NAMES,
+    MODEL_INPUT_SIZE, CONFIDENCE_THRESHOLD, MARGIN_THRESHOLD,
+    INFERENCE_BACKEND, TFLITE_VARIANT, TFLITE_THREADS,
+)
+
+BACKENDS = ("keras", "tflite")
+TFLITE_VARIANTS = ("float16", "int8")
+
+NO_EYE_INDEX = FIRST_CLASS_NAMES.index("No Eye Detected")
+
+
+# --- Preprocessing ---
+# The models take float32 RGB at MODEL_INPUT_SIZE, while crops are kept as the
+# uint8 BGR arrays OpenCV decodes. The cascade does the conversion itself
+# (`graph_preprocess`); `preprocess_image` is the host-side version for calling
+# a model directly. benchmark.py checks that the two agree, colour order included.
+def preprocess_image(image_np, target_size=MODEL_INPUT_SIZE):
+    """Resizes, converts to RGB, and expands dimensions for model input."""
+    image_resized = cv2.resize(image_np, target_size)
+    image_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
+    image_array = np.expand_dims(image_rgb.astype("float32"), axis=0)
+    return image_array
+
+
+def fit_to_model(image_np, target_size=MODEL_INPUT_SIZE):
+    """The uint8 BGR crop at model input size, for stacking crops into a batch.
+    A crop that already has that size is returned as is."""
+    if image_np.shape[1::-1] == tuple(target_size):
+        return image_np
+    return cv2.resize(image_np, target_size)
+
+
+def graph_preprocess(images, target_size=MODEL_INPUT_SIZE):
+    """TensorFlow version of `preprocess_image` for a uint8 BGR batch of any size.
+
+    Bilinear resizing with half-pixel centres, as cv2.INTER_LINEAR does; unlike
+    OpenCV the result is not rounded back to whole grey levels, so the two
+    differ by at most one level.
+    """
+    import tensorflow as tf
+    width, height = target_size
+    images = tf.convert_to_tensor(images)
+    resized = tf.cond(
+        tf.logical_and(tf.equal(tf.shape(images)[1], height), tf.equal(tf.shape(images)[2], width)),
+        lambda: tf.cast(images, tf.float32),
+        lambda: tf.image.resize(images, (height, width), method="bilinear"),
+    )
+    # The one colour conversion on the way into the models: BGR -> RGB
+    return tf.reverse(resized, axis=[-1])
+
+
+# --- Loading ---
+def tflite_path(model_path, variant=TFLITE_VARIANT):
+    """Where the converted copy of a Keras model lives, e.g. EyeDetect.int8.tflite."""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}.{variant}.tflite"
+
+
+def load_inference_model(model_path, backend=INFERENCE_BACKEND, variant=TFLITE_VARIANT):
+    """Loads one model on the requested backend ("keras" or "tflite")."""
+    if backend == "keras":
+        from tensorflow.keras.models import load_model
+        return load_model(model_path)
+    if backend == "tflite":
+        return TFLiteModel(tflite_path(model_path, variant), num_threads=TFLITE_THREADS)
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+
+
+def model_files(backend=INFERENCE_BACKEND, variant=TFLITE_VARIANT):
+    """The files the detection and condition models are loaded from."""
+    if backend == "tflite":
+        return tflite_path(FIRST_MODEL_PATH, variant), tflite_path(SEC_MODEL_PATH, variant)
+    return FIRST_MODEL_PATH, SEC_MODEL_PATH
+
+
+def load_models(backend=INFERENCE_BACKEND, variant=TFLITE_VARIANT):
+    """Loads the eye detection and eye condition models from disk."""
+    return (load_inference_model(FIRST_MODEL_PATH, backend, variant),
+            load_inference_model(SEC_MODEL_PATH, backend, variant))
+
+
+def _tflite_interpreter_class():
+    # The standalone LiteRT runtime is preferred when installed; TensorFlow ships
+    # the same interpreter otherwise
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """A converted .tflite model behind the same predict() call as a Keras model."""
+
+    def __init__(self, path, num_threads=None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found, create it with 'python tflite_tools.py convert'")
+        self.path = path
+        self.interpreter = _tflite_interpreter_class()(model_path=path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+        # An interpreter holds its tensors in place, so calls must not overlap
+        self._lock = threading.Lock()
+
+    def predict(self, images, verbose=0):
+        images = np.asarray(images, dtype=np.float32)
+        with self._lock:
+            if images.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], list(images.shape))
+                self.interpreter.allocate_tensors()
+                self._batch_size = images.shape[0]
+            self.interpreter.set_tensor(self._input["index"], _quantize(images, self._input))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"]).copy()
+        return _dequantize(output, self._output)
+
+    __call__ = predict
+
+
+def _quantize(values, details):
+    scale, zero_point = details["quantization"]
+    if details["dtype"] == np.float32 or not scale:
+        return values.astype(details["dtype"])
+    info = np.iinfo(details["dtype"])
+    return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(details["dtype"])
+
+
+def _dequantize(values, details):
+    scale, zero_point = details["quantization"]
+    if details["dtype"] == np.float32 or not scale:
+        return values.astype(np.float32)
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+# --- Label decoding (shared by every inference path) ---
+def detection_label(prediction):
+    """Turns one row of EyeDetect output into (label, confidence)."""
+    predicted_class_index = np.argmax(prediction)
+    confidence = prediction[predicted_class_index]
+    return FIRST_CLASS_NAMES[predicted_class_index], confidence
+
+
+def condition_label(prediction):
+    """Turns one row of EyeAnalysis output into (label, confidence), applying the
+    confidence and margin rules."""
+    top_2 = np.sort(prediction)[-2:]
+    confidence = top_2[-1]
+    margin = top_2[-1] - top_2[-2]
+
+    predicted_class_index = np.argmax(prediction)
+
+    if confidence < CONFIDENCE_THRESHOLD or margin < MARGIN_THRESHOLD:
+        return "Uncertain", confidence
+    return SEC_CLASS_NAMES[predicted_class_index], confidence
+
+
+def eye_blocks_condition(eye_label, eye_confidence):
+    """True when detection is confident there is no eye, so no condition result
+    may be shown."""
+    return "No Eye Detected" in eye_label and eye_confidence > CONFIDENCE_THRESHOLD
+
+
+def final_label(result):
+    """The single label a user would see for one decoded cascade result."""
+    return "No Eye Detected" if result["no_eye"] else result["condition_label"]
+
+
+# --- Fused cascade ---
+def gate_outputs(detection, condition):
+    """NumPy version of the gating traced into the Keras cascade, used by
+    backends that cannot be traced."""
+    eye_index = np.argmax(detection, axis=-1).astype(np.int32)
+    eye_confidence = np.max(detection, axis=-1)
+    top_2 = np.sort(condition, axis=-1)[:, -2:]
+    condition_confidence = top_2[:, -1]
+    margin = top_2[:, -1] - top_2[:, -2]
+    return {
+        "detection": detection,
+        "condition": condition,
+        "eye_index": eye_index,
+        "eye_confidence": eye_confidence,
+        "condition_index": np.argmax(condition, axis=-1).astype(np.int32),
+        "condition_confidence": condition_confidence,
+        "no_eye": (eye_index == NO_EYE_INDEX) & (eye_confidence > CONFIDENCE_THRESHOLD),
+        "uncertain": (condition_confidence < CONFIDENCE_THRESHOLD) | (margin < MARGIN_THRESHOLD),
+    }
+
+
+def build_cascade(first_model, sec_model, jit_compile=False, tta_views=1):
+    """Traces preprocessing, both models and the threshold gating into one tf.function.
+
+    The returned function takes a uint8 BGR batch of crops of any (shared) size,
+    such as a decoded crop with a batch axis added or a stack of `fit_to_model`
+    crops, and returns a dict of tensors, one row per image. `jit_compile`
+    compiles the models and gating with XLA (once per batch size); resizing
+    stays outside the compiled part so new crop sizes do not recompile.
+    With `tta_views` > 1 the condition is averaged over that many augmented
+    views (see tta.py), built in the graph and run in the same call; detection
+    still sees only the crop itself. TFLite models cannot be traced, so for them
+    the batch is preprocessed in NumPy, the two interpreters run back to back
+    and the gating is done in NumPy.
+    """
+    from tta import augment_views, graph_augment_views
+
+    if isinstance(first_model, TFLiteModel) or isinstance(sec_model, TFLiteModel):
+        def run_both(images):
+            images = np.concatenate([preprocess_image(image) for image in images])
+            if tta_views > 1:
+                condition = np.stack([sec_model.predict(augment_views(image, tta_views)).mean(axis=0)
+                                      for image in images])
+            else:
+                condition = sec_model.predict(images)
+            return gate_outputs(first_model.predict(images), condition)
+        return run_both
+
+    import tensorflow as tf
+    width, height = MODEL_INPUT_SIZE
+
+    @tf.function(input_signature=[tf.TensorSpec([None, height, width, 3], tf.float32)], jit_compile=jit_compile)
+    def gated(images):
+        detection = first_model(images, training=False)
+        if tta_views > 1:
+            views = graph_augment_views(images, tta_views)
+            condition = sec_model(views, training=False)
+            condition = tf.reduce_mean(tf.reshape(condition, [-1, tf.shape(images)[0], condition.shape[-1]]), axis=0)
+        else:
+            condition = sec_model(images, training=False)
+
+        eye_index = tf.argmax(detection, axis=-1, output_type=tf.int32)
+        eye_confidence = tf.reduce_max(detection, axis=-1)
+        top_2 = tf.math.top_k(condition, k=2).values
+        condition_confidence = top_2[:, 0]
+        margin = top_2[:, 0] - top_2[:, 1]
+
+        return {
+            "detection": detection,
+            "condition": condition,
+            "eye_index": eye_index,
+            "eye_confidence": eye_confidence,
+            "condition_index": tf.argmax(condition, axis=-1, output_type=tf.int32),
+            "condition_confidence": condition_confidence,
+            "no_eye": tf.logical_and(tf.equal(eye_index, NO_EYE_INDEX),
+                                     eye_confidence > CONFIDENCE_THRESHOLD),
+            "uncertain": tf.logical_or(condition_confidence < CONFIDENCE_THRESHOLD,
+                                       margin < MARGIN_THRESHOLD),
+        }
+
+    @tf.function(input_signature=[tf.TensorSpec([None, None, None, 3], tf.uint8)])
+    def cascade(images):
+        return gated(graph_preprocess(images))
+
+    return cascade
+
+
+def run_cascade(cascade, images):
+    """Runs the cascade on a uint8 BGR batch, or on one crop, and returns numpy
+    outputs. A single crop gets its batch axis as a view, without a copy."""
+    images = np.asarray(images)
+    if images.dtype != np.uint8:
+        raise TypeError(f"the cascade takes uint8 BGR crops, got {images.dtype}")
+    if images.ndim == 3:
+        images = images[np.newaxis]
+    outputs = cascade(images)
+    return {name: np.asarray(value) for name, value in outputs.items()}
+
+
+def decode_cascade(outputs):
+    """Splits batched cascade outputs into one result dict per image. "detection"
+    and "condition" hold the image's raw probabilities, for callers that
+    aggregate several results (video)."""
+    results = []
+    for i in range(len(outputs["eye_index"])):
+        condition_name = SEC_CLASS_NAMES[outputs["condition_index"][i]]
+        results.append({
+            "eye_label": FIRST_CLASS_NAMES[outputs["eye_index"][i]],
+            "eye_confidence": outputs["eye_confidence"][i],
+            "no_eye": bool(outputs["no_eye"][i]),
+            "condition_label": "Uncertain" if outputs["uncertain"][i] else condition_name,
+            "condition_confidence": outputs["condition_confidence"][i],
+            "detection": outputs["detection"][i],
+            "condition": outputs["condition"][i],
+        })
+    return results
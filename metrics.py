@@ -0,0 +1,264 @@
+"""Stage timers, counters and a Prometheus endpoint for the analysis pipeline.
+
+Everything here is a no-op until `enable()` is called, so instrumented code
+pays one flag check per call when metrics are off.
+
+    with metrics.timed("preprocess"):
+        ...
+    metrics.inc("ocuscan_results_total", result="Uncertain")
+
+    with metrics.request_trace("analysis") as trace:
+        ...
+        trace.annotate(result=label)
+
+Timers entered inside a `request_trace` on the same thread are also collected
+into that request's structured log line (logger "ocuscan.requests").
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger("ocuscan.requests")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = False
+_server = None
+_enable_lock = threading.Lock()
+_local = threading.local()
+_NOOP = contextlib.nullcontext()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Registry:
+    """Counters, gauges and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_callbacks = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1.0, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = float(value)
+
+    def gauge_callback(self, name, fn):
+        """Registers `fn() -> {labels_tuple_or_(): value}` evaluated at scrape time."""
+        with self._lock:
+            self._gauge_callbacks[name] = fn
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets),
+                                                     "sum": 0.0, "count": 0}
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            callbacks = dict(self._gauge_callbacks)
+            histograms = {key: dict(h, counts=list(h["counts"])) for key, h in self._histograms.items()}
+        for name, fn in callbacks.items():
+            try:
+                for labels, value in fn().items():
+                    gauges[(name, tuple(labels))] = float(value)
+            except Exception:
+                logger.exception("Gauge callback %s failed", name)
+
+        def header(name, kind, seen):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        seen = set()
+        for (name, key), value in sorted(counters.items()):
+            header(name, "counter", seen)
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), value in sorted(gauges.items()):
+            header(name, "gauge", seen)
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), h in sorted(histograms.items()):
+            header(name, "histogram", seen)
+            for bound, count in zip(h["buckets"], h["counts"]):
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {h['count']}")
+            lines.append(f"{name}_sum{_format_labels(key)} {h['sum']}")
+            lines.append(f"{name}_count{_format_labels(key)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.describe("ocuscan_stage_seconds", "Time spent in each pipeline stage.")
+registry.describe("ocuscan_results_total", "Analyses by the result shown to the user.")
+registry.describe("ocuscan_prediction_cache_total", "Prediction cache lookups by outcome.")
+registry.describe("ocuscan_startup_seconds", "Time taken by each startup step.")
+registry.describe("ocuscan_quality_total", "Quality gate outcomes; rejected images skipped inference.")
+registry.describe("ocuscan_quality_problems_total", "Quality problems found, by kind.")
+
+
+# --- Public API ---
+def enabled():
+    return _enabled
+
+
+def enable(port=None, host="127.0.0.1"):
+    """Turns instrumentation on and, if `port` is given, serves /metrics there.
+    Safe to call on every Streamlit rerun."""
+    global _enabled, _server
+    with _enable_lock:
+        _enabled = True
+        if port and _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info("Serving Prometheus metrics on http://%s:%d/metrics", host, port)
+
+
+def inc(name, value=1.0, **labels):
+    if _enabled:
+        registry.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    if _enabled:
+        registry.set_gauge(name, value, **labels)
+
+
+def gauge_callback(name, fn):
+    if _enabled:
+        registry.gauge_callback(name, fn)
+
+
+def observe(name, value, **labels):
+    if _enabled:
+        registry.observe(name, value, **labels)
+
+
+def timed(stage):
+    """Context manager recording the duration of `stage`."""
+    if not _enabled:
+        return _NOOP
+    return _StageTimer(stage)
+
+
+def request_trace(kind):
+    """Context manager that collects stage timings for one request and logs them
+    as a single JSON line when it exits."""
+    if not _enabled:
+        return _NULL_TRACE
+    return _RequestTrace(kind)
+
+
+class _StageTimer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        registry.observe("ocuscan_stage_seconds", elapsed, stage=self.stage)
+        trace = getattr(_local, "trace", None)
+        if trace is not None:
+            trace.stages[self.stage] = trace.stages.get(self.stage, 0.0) + elapsed
+
+
+class _RequestTrace:
+    def __init__(self, kind):
+        self.kind = kind
+        self.fields = {}
+        self.stages = {}
+
+    def annotate(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self._outer = getattr(_local, "trace", None)
+        _local.trace = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self._outer
+        record = {
+            "event": self.kind,
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+        }
+        record.update(self.fields)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        request_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+class _NullTrace:
+    def annotate(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TRACE = _NullTrace()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise flood stderr
+        pass
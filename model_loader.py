@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from config import MODEL_INPUT_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up_input(batch_size=1, dtype=np.float32):
+    """A blank batch with the models' input shape; the cascade takes uint8."""
+    width, height = MODEL_INPUT_SIZE
+    return np.zeros((batch_size, height, width, 3), dtype=dtype)
+
+
+class ModelLoader:
+    """Imports TensorFlow and loads both models on background threads.
+
+    The detection and condition models are deserialized concurrently, each gets
+    a warm-up forward pass, and then `build_cascade` is called and run once so
+    its graph is traced before the first real request. `ready()` and `wait()`
+    let the UI render immediately and block only where a model is needed.
+
+    `configure`, if given, runs on the loader thread before TensorFlow is
+    imported, which is the last point where its runtime options can be set.
+    """
+
+    def __init__(self, load_first, load_sec, build_cascade=None, warm_up=True, configure=None):
+        self._configure = configure
+        self._load_first = load_first
+        self._load_sec = load_sec
+        self._build_cascade = build_cascade
+        self._warm_up = warm_up
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self.timings = {}
+        self._started = time.perf_counter()
+        threading.Thread(target=self._run, name="model-loader", daemon=True).start()
+
+    def ready(self):
+        """True once loading has finished, successfully or not."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until loading finishes and returns (first_model, sec_model, cascade).
+        Re-raises the loading error, if any."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("Models are still loading")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _timed(self, stage, fn, *args):
+        start = time.perf_counter()
+        value = fn(*args)
+        self.timings[stage] = time.perf_counter() - start
+        logger.info("Startup: %s took %.2fs", stage, self.timings[stage])
+        metrics.set_gauge("ocuscan_startup_seconds", self.timings[stage], stage=stage)
+        return value
+
+    def _load_and_warm(self, name, load):
+        model = self._timed(f"load_{name}", load)
+        if self._warm_up:
+            self._timed(f"warm_up_{name}", lambda: model.predict(warm_up_input(), verbose=0))
+        return model
+
+    def _run(self):
+        try:
+            if self._configure is not None:
+                self._timed("configure", self._configure)
+            # Importing TensorFlow dominates cold start; do it once up front so
+            # the two loader threads don't both wait on the import lock
+            self._timed("import_tensorflow", __import__, "tensorflow")
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-load") as pool:
+                first_future = pool.submit(self._load_and_warm, "first_model", self._load_first)
+                sec_future = pool.submit(self._load_and_warm, "sec_model", self._load_sec)
+                first_model, sec_model = first_future.result(), sec_future.result()
+            cascade = None
+            if self._build_cascade is not None:
+                cascade = self._build_cascade(first_model, sec_model)
+                if self._warm_up:
+                    self._timed("warm_up_cascade", cascade, warm_up_input(dtype=np.uint8))
+            self._result = (first_model, sec_model, cascade)
+        except BaseException as e:
+            logger.exception("Model loading failed")
+            self._error = e
+        finally:
+            self.timings["total"] = time.perf_counter() - self._started
+            logger.info("Startup: model loading finished in %.2fs", self.timings["total"])
+            metrics.set_gauge("ocuscan_startup_seconds", self.timings["total"], stage="total")
+            self._done.set()
@@ -0,0 +1,87 @@
+"""Cheap image quality checks that run before any model call.
+
+Blurry, dark, washed-out or tiny crops still go through both models only to
+come back "Uncertain" or "No Eye Detected". `assess` measures them on a
+grayscale copy at most 256 px wide, in a few milliseconds: sharpness is the
+variance of the Laplacian, exposure comes from one 256-bin histogram (mean grey
+level and the share of clipped shadows and highlights), and resolution is the
+crop's shorter side.
+
+`gate` applies OCUSCAN_QUALITY_MODE: "reject" stops the analysis, "warn" lets it
+run and reports the problems, "off" skips the checks. Every outcome is counted
+in ocuscan_quality_total, so the "rejected" count is the number of inferences
+avoided.
+"""
+import cv2
+import numpy as np
+
+import metrics
+from config import (
+    QUALITY_MODE, QUALITY_MIN_SIDE, QUALITY_MIN_SHARPNESS, QUALITY_MIN_BRIGHTNESS, QUALITY_MAX_BRIGHTNESS,
+    QUALITY_MAX_CLIPPED,
+)
+
+PROBLEMS = ("too_small", "blurry", "too_dark", "too_bright")
+
+_CLIP_LEVELS = 8  # grey levels at each end of the histogram that count as clipped
+_LEVELS = np.arange(256, dtype=np.float64)
+
+
+def _gray_proxy(image_np, max_side=256):
+    gray = image_np if image_np.ndim == 2 else cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
+    scale = max_side / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def sharpness(image_np, max_side=256):
+    """Variance of the Laplacian on a downscaled grayscale copy; low means blurry."""
+    return float(cv2.Laplacian(_gray_proxy(image_np, max_side), cv2.CV_32F).var())
+
+
+def assess(image_np, min_side=QUALITY_MIN_SIDE, min_sharpness=QUALITY_MIN_SHARPNESS,
+           min_brightness=QUALITY_MIN_BRIGHTNESS, max_brightness=QUALITY_MAX_BRIGHTNESS,
+           max_clipped=QUALITY_MAX_CLIPPED):
+    """Measures a BGR crop and lists what is wrong with it under "problems"."""
+    height, width = image_np.shape[:2]
+    gray = _gray_proxy(image_np)
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+    report = {
+        "width": width,
+        "height": height,
+        "sharpness": float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+        "brightness": float(histogram @ _LEVELS),
+        "clipped_dark": float(histogram[:_CLIP_LEVELS].sum()),
+        "clipped_bright": float(histogram[-_CLIP_LEVELS:].sum()),
+    }
+    problems = []
+    if min(height, width) < min_side:
+        problems.append("too_small")
+    if report["sharpness"] < min_sharpness:
+        problems.append("blurry")
+    if report["brightness"] < min_brightness or report["clipped_dark"] > max_clipped:
+        problems.append("too_dark")
+    if report["brightness"] > max_brightness or report["clipped_bright"] > max_clipped:
+        problems.append("too_bright")
+    report["problems"] = problems
+    return report
+
+
+def gate(image_np, mode=QUALITY_MODE, report=None):
+    """Returns (report, rejected). The report is None when the checks are off.
+
+    `report` is an `assess` result measured earlier, e.g. on the full-resolution
+    crop before it was fitted to the model input size.
+    """
+    if mode == "off":
+        return None, False
+    if report is None:
+        with metrics.timed("quality"):
+            report = assess(image_np)
+    rejected = mode == "reject" and bool(report["problems"])
+    outcome = "rejected" if rejected else "warned" if report["problems"] else "passed"
+    metrics.inc("ocuscan_quality_total", outcome=outcome)
+    for problem in report["problems"]:
+        metrics.inc("ocuscan_quality_problems_total", problem=problem)
+    return report, rejected
@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SessionImageStore:
+    """Process-wide, memory-bounded store for the images each session works on.
+
+    Values are numpy arrays grouped per session. A session may hold at most
+    `per_session_bytes`; beyond that its own least recently used images go
+    first. When all sessions together exceed `global_bytes`, or a session has not
+    been touched for `idle_seconds`, whole sessions are evicted, least recently
+    used first. An evicted image simply reads back as None.
+    """
+
+    def __init__(self, per_session_bytes, global_bytes, idle_seconds=1800.0):
+        self.per_session_bytes = per_session_bytes
+        self.global_bytes = global_bytes
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.evicted_sessions = 0
+
+    def get(self, session_id, name):
+        with self._lock:
+            self._expire_idle()
+            session = self._sessions.get(session_id)
+            if session is None or name not in session["images"]:
+                return None
+            self._touch(session_id, session)
+            session["images"].move_to_end(name)
+            return session["images"][name]
+
+    def put(self, session_id, name, image_np):
+        size = image_np.nbytes
+        if size > self.per_session_bytes:
+            logger.warning("Image '%s' (%d bytes) exceeds the per-session budget; not stored", name, size)
+            self.discard(session_id, name)
+            return False
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = {"images": OrderedDict(), "bytes": 0}
+            self._remove(session, name)
+            session["images"][name] = image_np
+            session["bytes"] += size
+            self._bytes += size
+            self._touch(session_id, session)
+            while session["bytes"] > self.per_session_bytes:
+                self._remove(session, next(iter(session["images"])))
+            self._expire_idle()
+            while self._bytes > self.global_bytes and len(self._sessions) > 1:
+                oldest = next(iter(self._sessions))
+                if oldest == session_id:
+                    break
+                self._evict(oldest)
+        return True
+
+    def discard(self, session_id, name=None):
+        """Drops one image, or every image of the session when `name` is None."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            if name is None:
+                self._evict(session_id, count=False)
+            else:
+                self._remove(session, name)
+
+    def usage(self):
+        with self._lock:
+            return {"bytes": self._bytes, "sessions": len(self._sessions),
+                    "evicted_sessions": self.evicted_sessions}
+
+    # --- internals, called with the lock held ---
+    def _touch(self, session_id, session):
+        session["last_used"] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+
+    def _remove(self, session, name):
+        image_np = session["images"].pop(name, None)
+        if image_np is not None:
+            session["bytes"] -= image_np.nbytes
+            self._bytes -= image_np.nbytes
+
+    def _evict(self, session_id, count=True):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session["bytes"]
+        if count:
+            self.evicted_sessions += 1
+
+    def _expire_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session["last_used"] >= cutoff:
+                break
+            self._evict(session_id)
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeExecutor:
+    """Starts the detection and condition models at the same time on a shared pool.
+
+    Most images do contain an eye, so the condition model is run speculatively
+    instead of waiting for detection. When detection rules the image out, the
+    condition run is cancelled if it has not started yet, or its result is
+    discarded and the time it used is counted as waste.
+
+    `detect(x)` and `classify(x)` take a preprocessed batch of one and return
+    (label, confidence); `blocks_condition(label, confidence)` decides whether a
+    detection result means the condition result must not be shown.
+    """
+
+    def __init__(self, detect, classify, blocks_condition, max_workers=4):
+        self.detect = detect
+        self.classify = classify
+        self.blocks_condition = blocks_condition
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.used = 0
+        self.cancelled = 0
+        self.discarded = 0
+        self.condition_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    def _timed_classify(self, processed_image):
+        start = time.perf_counter()
+        result = self.classify(processed_image)
+        return result, time.perf_counter() - start
+
+    def run(self, processed_image):
+        """Returns (detection, condition); condition is None when detection blocks it."""
+        detection_future = self.pool.submit(self.detect, processed_image)
+        condition_future = self.pool.submit(self._timed_classify, processed_image)
+        detection = detection_future.result()
+
+        if not self.blocks_condition(*detection):
+            condition, seconds = condition_future.result()
+            self._record("used", seconds)
+            return detection, condition
+
+        if condition_future.cancel():
+            self._record("cancelled", 0.0)
+        else:
+            # Already running: let it finish in the background and count the waste
+            condition_future.add_done_callback(self._discard)
+        return detection, None
+
+    def _discard(self, future):
+        seconds = future.result()[1] if future.exception() is None else 0.0
+        self._record("discarded", seconds)
+
+    def _record(self, outcome, seconds):
+        with self._lock:
+            self.runs += 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            self.condition_seconds += seconds
+            if outcome == "discarded":
+                self.wasted_seconds += seconds
+        metrics.inc("ocuscan_speculative_total", outcome=outcome)
+        if outcome == "discarded":
+            metrics.inc("ocuscan_speculative_wasted_seconds_total", seconds)
+            logger.debug("Discarded speculative condition run (%.3fs)", seconds)
+
+    def stats(self):
+        """How much condition-model compute went to runs whose result was thrown away."""
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "used": self.used,
+                "cancelled": self.cancelled,
+                "discarded": self.discarded,
+                "condition_seconds": self.condition_seconds,
+                "wasted_seconds": self.wasted_seconds,
+                "wasted_fraction": self.wasted_seconds / self.condition_seconds if self.condition_seconds else 0.0,
+            }
@@ -0,0 +1,196 @@
+"""Convert the Keras models to TFLite and check the converted copies against them.
+
+    python tflite_tools.py convert --calibration-dir samples/
+    python tflite_tools.py parity labelled/ --variant int8
+
+`convert` writes <model>.float16.tflite and <model>.int8.tflite next to each
+.keras file; int8 needs a folder of representative eye images for calibration.
+
+`parity` expects one sub-folder per expected result ("Healthy", "No Eye Detected",
+...). It runs every image through both backends and reports class agreement,
+confidence deltas and whether the "Uncertain" / "No Eye Detected" gating still
+fires on the same images. It exits non-zero when final-label agreement is below
+--min-agreement.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+from config import FIRST_MODEL_PATH, SEC_MODEL_PATH, FIRST_CLASS_NAMES, SEC_CLASS_NAMES
+from inference import (
+    TFLITE_VARIANTS, tflite_path, load_models, build_cascade, run_cascade, preprocess_image,
+    decode_cascade, final_label,
+)
+from batch_score import iter_images, load_and_preprocess
+
+KNOWN_LABELS = set(SEC_CLASS_NAMES) | set(FIRST_CLASS_NAMES) | {"Uncertain"}
+
+
+def load_samples(source, limit=None):
+    """Model-size uint8 crops for up to `limit` images, with their names."""
+    names, images = [], []
+    for name, read in iter_images(source):
+        name, image, error = load_and_preprocess(name, read)
+        if error is not None:
+            print(f"skipping {name}: {error}", file=sys.stderr)
+            continue
+        names.append(name)
+        images.append(image)
+        if limit and len(images) >= limit:
+            break
+    return names, images
+
+
+# --- Conversion ---
+def convert_model(model_path, variant, calibration_images=None):
+    """Converts one .keras file and returns the TFLite flatbuffer."""
+    model = load_model(model_path)
+    with tempfile.TemporaryDirectory() as export_dir:
+        # Keras 3 models convert reliably only through a SavedModel export
+        model.export(export_dir, format="tf_saved_model", verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if variant == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        elif variant == "int8":
+            if not calibration_images:
+                raise ValueError("int8 conversion needs calibration images (--calibration-dir)")
+
+            def representative_dataset():
+                for image in calibration_images:
+                    yield [preprocess_image(image)]
+
+            converter.representative_dataset = representative_dataset
+            # Weights and activations in int8, with float kernels only for ops
+            # that have no int8 version; inputs and outputs stay float32
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS,
+            ]
+        else:
+            raise ValueError(f"Unknown variant '{variant}', expected one of {TFLITE_VARIANTS}")
+        return converter.convert()
+
+
+def convert(variants, calibration_dir=None, calibration_samples=200):
+    calibration_images = None
+    if "int8" in variants:
+        if not calibration_dir:
+            raise SystemExit("int8 conversion needs --calibration-dir")
+        _, calibration_images = load_samples(calibration_dir, calibration_samples)
+        print(f"Calibrating int8 on {len(calibration_images)} image(s)")
+    for model_path in (FIRST_MODEL_PATH, SEC_MODEL_PATH):
+        for variant in variants:
+            output_path = tflite_path(model_path, variant)
+            flatbuffer = convert_model(model_path, variant, calibration_images)
+            with open(output_path, "wb") as f:
+                f.write(flatbuffer)
+            print(f"{model_path} -> {output_path} ({len(flatbuffer) / 1e6:.2f} MB, "
+                  f"Keras file {os.path.getsize(model_path) / 1e6:.2f} MB)")
+
+
+# --- Parity ---
+def _agreement(a, b):
+    return float(np.mean(np.asarray(a) == np.asarray(b))) if len(a) else 1.0
+
+
+def _deltas(a, b):
+    delta = np.abs(np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64))
+    if not delta.size:
+        return {"mean": 0.0, "p95": 0.0, "max": 0.0}
+    return {"mean": float(delta.mean()), "p95": float(np.percentile(delta, 95)), "max": float(delta.max())}
+
+
+def parity(source, variant, batch_size=32):
+    """Runs the labelled folder through Keras and TFLite and compares them."""
+    names, images = load_samples(source)
+    if not images:
+        raise SystemExit(f"No readable images under {source}")
+    cascades = {
+        "keras": build_cascade(*load_models("keras")),
+        "tflite": build_cascade(*load_models("tflite", variant)),
+    }
+    outputs = {backend: [] for backend in cascades}
+    for start in range(0, len(images), batch_size):
+        batch = np.stack(images[start:start + batch_size])
+        for backend, cascade in cascades.items():
+            outputs[backend].append(run_cascade(cascade, batch))
+    merged = {
+        backend: {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        for backend, parts in outputs.items()
+    }
+    keras_out, tflite_out = merged["keras"], merged["tflite"]
+    keras_labels = [final_label(r) for r in decode_cascade(keras_out)]
+    tflite_labels = [final_label(r) for r in decode_cascade(tflite_out)]
+
+    report = {
+        "images": len(names),
+        "variant": variant,
+        "detection_class_agreement": _agreement(keras_out["eye_index"], tflite_out["eye_index"]),
+        "condition_class_agreement": _agreement(keras_out["condition_index"], tflite_out["condition_index"]),
+        "no_eye_gate_agreement": _agreement(keras_out["no_eye"], tflite_out["no_eye"]),
+        "uncertain_gate_agreement": _agreement(keras_out["uncertain"], tflite_out["uncertain"]),
+        "uncertain_rate": {"keras": float(np.mean(keras_out["uncertain"])),
+                           "tflite": float(np.mean(tflite_out["uncertain"]))},
+        "final_label_agreement": _agreement(keras_labels, tflite_labels),
+        "detection_confidence_delta": _deltas(keras_out["eye_confidence"], tflite_out["eye_confidence"]),
+        "condition_confidence_delta": _deltas(keras_out["condition_confidence"], tflite_out["condition_confidence"]),
+        "condition_probability_delta": _deltas(keras_out["condition"], tflite_out["condition"]),
+    }
+
+    expected = [name.replace("\\", "/").split("/")[0] for name in names]
+    labelled = [i for i, label in enumerate(expected) if label in KNOWN_LABELS]
+    if labelled:
+        report["accuracy"] = {
+            "labelled_images": len(labelled),
+            "keras": _agreement([keras_labels[i] for i in labelled], [expected[i] for i in labelled]),
+            "tflite": _agreement([tflite_labels[i] for i in labelled], [expected[i] for i in labelled]),
+        }
+    report["disagreements"] = [
+        {"file": name, "keras": k, "tflite": t}
+        for name, k, t in zip(names, keras_labels, tflite_labels) if k != t
+    ]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TFLite conversion and Keras parity checks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = commands.add_parser("convert", help="Export both models to TFLite")
+    convert_parser.add_argument("--variants", nargs="+", choices=TFLITE_VARIANTS, default=list(TFLITE_VARIANTS))
+    convert_parser.add_argument("--calibration-dir", help="Folder or zip of representative eye images (int8)")
+    convert_parser.add_argument("--calibration-samples", type=int, default=200)
+
+    parity_parser = commands.add_parser("parity", help="Compare a TFLite variant against the Keras models")
+    parity_parser.add_argument("source", help="Folder with one sub-folder per expected result")
+    parity_parser.add_argument("--variant", choices=TFLITE_VARIANTS, default="int8")
+    parity_parser.add_argument("--batch-size", type=int, default=32)
+    parity_parser.add_argument("--min-agreement", type=float, default=0.99,
+                               help="Fail when final-label agreement is below this (default: 0.99)")
+    parity_parser.add_argument("--report", help="Also write the report to this JSON file")
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        convert(args.variants, args.calibration_dir, args.calibration_samples)
+        return 0
+
+    report = parity(args.source, args.variant, args.batch_size)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text)
+    if report["final_label_agreement"] < args.min_agreement:
+        print(f"FAIL: final-label agreement {report['final_label_agreement']:.4f} < {args.min_agreement}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Test-time augmentation for the condition classifier.
+
+A preprocessed crop is turned into a fixed set of slightly altered views
+(flips, small shifts and zooms, brightness changes) with one NumPy gather, the
+views go through the model as a single batch, and their probabilities are
+averaged before the confidence and margin rules are applied. The views are
+deterministic, so the same crop always gets the same result.
+
+`graph_augment_views` builds the same views inside a TensorFlow graph, which is
+how the fused cascade scores the condition when TTA is on.
+"""
+import numpy as np
+
+# (horizontal flip, shift x, shift y, zoom, brightness); shifts are fractions of
+# the image side. The first view is always the crop itself.
+VIEW_SPECS = (
+    (0, 0.0, 0.0, 1.0, 1.0),
+    (1, 0.0, 0.0, 1.0, 1.0),
+    (0, 0.0, 0.0, 1.1, 1.0),
+    (0, 0.04, 0.0, 1.0, 1.0),
+    (0, -0.04, 0.0, 1.0, 1.0),
+    (0, 0.0, 0.0, 1.0, 1.1),
+    (0, 0.0, 0.0, 1.0, 0.9),
+    (1, 0.0, 0.0, 1.1, 1.0),
+    (0, 0.0, 0.04, 1.0, 1.0),
+    (0, 0.0, -0.04, 1.0, 1.0),
+    (1, 0.04, 0.0, 0.95, 1.05),
+    (1, -0.04, 0.0, 1.05, 0.95),
+)
+MAX_VIEWS = len(VIEW_SPECS)
+
+
+def _source_indices(length, shift, zoom, flip):
+    """For each view, which source pixel every output pixel along one axis reads
+    (nearest neighbour, edges repeated)."""
+    centre = (length - 1) / 2
+    source = (np.arange(length)[None, :] - centre) / zoom[:, None] + centre - shift[:, None] * length
+    source = np.where(flip[:, None], length - 1 - source, source)
+    return np.clip(np.rint(source), 0, length - 1).astype(np.intp)
+
+
+def view_indices(height, width, views):
+    """(rows, cols, gains) for the first `views` views: rows is (views, H) and
+    cols (views, W) source indices, gains one brightness factor per view."""
+    views = max(1, min(int(views), MAX_VIEWS))
+    flip, shift_x, shift_y, zoom, gain = np.array(VIEW_SPECS[:views], dtype=np.float64).T
+    rows = _source_indices(height, shift_y, zoom, np.zeros(views, dtype=bool))
+    cols = _source_indices(width, shift_x, zoom, flip.astype(bool))
+    return rows, cols, gain.astype(np.float32)
+
+
+def augment_views(processed_image, views):
+    """Returns a (views, H, W, 3) float32 batch of augmented copies of one
+    preprocessed image, shaped (H, W, 3) or (1, H, W, 3)."""
+    image = processed_image[0] if processed_image.ndim == 4 else processed_image
+    rows, cols, gains = view_indices(image.shape[0], image.shape[1], views)
+    batch = image[rows[:, :, None], cols[:, None, :]].astype(np.float32)
+    batch *= gains[:, None, None, None]
+    return np.clip(batch, 0.0, 255.0, out=batch)
+
+
+def graph_augment_views(images, views):
+    """TensorFlow version of `augment_views` for a preprocessed (B, H, W, 3)
+    batch with a static size; returns (views * B, H, W, 3), view-major."""
+    import tensorflow as tf
+    height, width = images.shape[1], images.shape[2]
+    rows, cols, gains = view_indices(height, width, views)
+    augmented = [
+        tf.gather(tf.gather(images, rows[v], axis=1), cols[v], axis=2) * gains[v]
+        for v in range(len(gains))
+    ]
+    return tf.clip_by_value(tf.concat(augmented, axis=0), 0.0, 255.0)
+
+
+def average_predictions(predictions):
+    """Mean class probabilities over the views of one image."""
+    return np.asarray(predictions, dtype=np.float32).mean(axis=0)
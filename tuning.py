@@ -0,0 +1,251 @@
+"""CPU tuning profiles for TensorFlow inference, and an autotuner that finds them.
+
+    python tuning.py tune --output tuning_profile.json
+    python tuning.py tune --stand-in --threads 1 4 8 --batch-sizes 1 8 --iterations 20
+    python tuning.py show tuning_profile.json
+
+`tune` tries every combination of intra-op threads, inter-op threads, oneDNN
+on/off and XLA jit_compile. These are fixed once TensorFlow has started, so each
+combination runs in its own subprocess. The subprocess times the cascade over
+both .keras models at every batch size. The best combination for `--objective`
+is written as a JSON profile.
+
+The app reads the profile named by OCUSCAN_TUNING_PROFILE and applies it before
+TensorFlow is imported. It also sizes the micro-batcher from the profile unless
+OCUSCAN_BATCH_MAX_SIZE is set. With OCUSCAN_INFERENCE_WORKERS every worker process
+applies the profile itself, capping its thread counts at that worker's share of
+the cores.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+OBJECTIVES = ("latency", "throughput", "balanced")
+
+
+# --- Profiles ---
+def host_info():
+    """What a profile was tuned on; a different host probably needs its own profile."""
+    return {"cpu_count": os.cpu_count(), "machine": platform.machine(), "processor": platform.processor(),
+            "system": platform.system()}
+
+
+def load_profile(path):
+    """Reads a profile written by `tune`, or returns None when there is none."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        profile = json.load(f)
+    tuned_on = profile.get("host", {}).get("cpu_count")
+    if tuned_on and tuned_on != os.cpu_count():
+        logger.warning("Tuning profile %s was made on a %d-core host, this one has %d cores",
+                       path, tuned_on, os.cpu_count())
+    logger.info("Using tuning profile %s: %s", path, describe(profile))
+    return profile
+
+
+def describe(profile):
+    return (f"intra_op_threads={profile['intra_op_threads']} inter_op_threads={profile['inter_op_threads']} "
+            f"onednn={profile['onednn']} jit_compile={profile['jit_compile']} batch_size={profile['batch_size']}")
+
+
+def apply_profile(profile, max_threads=None):
+    """Sets oneDNN and the thread pools. Must run before TensorFlow is imported;
+    a None profile leaves TensorFlow's defaults alone.
+
+    `max_threads` is the core share of one inference worker process. It caps
+    both of the profile's thread counts, which were tuned for a single process
+    owning the whole host; without a profile the worker gets `max_threads`
+    intra-op threads and one inter-op thread.
+    """
+    if profile is None and not max_threads:
+        return
+    if "tensorflow" in sys.modules:
+        logger.warning("TensorFlow was imported before the tuning profile was applied; "
+                       "the oneDNN setting will not take effect")
+    if profile is not None:
+        os.environ["TF_ENABLE_ONEDNN_OPTS"] = "1" if profile["onednn"] else "0"
+    intra = profile["intra_op_threads"] if profile else max_threads
+    inter = profile["inter_op_threads"] if profile else 1
+    if max_threads:
+        intra = min(intra, max_threads) if intra else max_threads
+        inter = min(inter, max_threads) if inter else 1
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra)
+        tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        logger.warning("Could not apply the tuned thread counts: %s", e)
+
+
+def profile_jit_compile(profile):
+    return bool(profile and profile["jit_compile"])
+
+
+def tuned_batch_size(profile, default):
+    """The profile's batch size, unless OCUSCAN_BATCH_MAX_SIZE was set explicitly."""
+    if profile is None or os.environ.get("OCUSCAN_BATCH_MAX_SIZE"):
+        return default
+    return profile["batch_size"]
+
+
+# --- One trial (runs in a subprocess) ---
+def run_trial(settings, batch_sizes, iterations, stand_in):
+    """Times the cascade at each batch size under `settings`, in this process."""
+    apply_profile(dict(settings, batch_size=None))
+    from inference import build_cascade, run_cascade, load_models, fit_to_model
+    from benchmark import measure, stand_in_models, synthetic_image
+
+    first_model, sec_model = stand_in_models() if stand_in else load_models()
+    cascade = build_cascade(first_model, sec_model, jit_compile=settings["jit_compile"])
+    single = fit_to_model(synthetic_image(640, 560))[np.newaxis]
+    results = {}
+    for batch_size in batch_sizes:
+        batch = np.repeat(single, batch_size, axis=0)
+        result = measure(lambda: run_cascade(cascade, batch), iterations, items_per_call=batch_size)
+        results[str(batch_size)] = {key: result[key] for key in ("p50_ms", "p95_ms", "throughput_per_s")}
+    return results
+
+
+def trial_in_subprocess(settings, batch_sizes, iterations, stand_in, timeout):
+    command = [sys.executable, os.path.abspath(__file__), "trial", json.dumps(settings),
+               "--batch-sizes", *map(str, batch_sizes), "--iterations", str(iterations)]
+    if stand_in:
+        command.append("--stand-in")
+    env = dict(os.environ, TF_ENABLE_ONEDNN_OPTS="1" if settings["onednn"] else "0", TF_CPP_MIN_LOG_LEVEL="2")
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=timeout, env=env)
+    except subprocess.TimeoutExpired:
+        return None, "timed out"
+    if completed.returncode != 0:
+        return None, completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"
+    return json.loads(completed.stdout.strip().splitlines()[-1]), None
+
+
+# --- Search ---
+def default_thread_counts(cpu_count=None):
+    """Powers of two up to the core count, plus the core count itself."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    counts = {cpu_count}
+    n = 1
+    while n < cpu_count:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def score_trials(trials, objective):
+    """Adds a "score" to every successful trial; lower is better.
+
+    latency: batch-1 p50. throughput: inverse of the best images per second.
+    balanced: geometric mean of both, each relative to the best trial.
+    """
+    ok = [t for t in trials if t["results"]]
+    best_latency = min(t["results"]["1"]["p50_ms"] for t in ok)
+    best_throughput = max(max(r["throughput_per_s"] for r in t["results"].values()) for t in ok)
+    for t in ok:
+        latency = t["results"]["1"]["p50_ms"] / best_latency
+        throughput = best_throughput / max(r["throughput_per_s"] for r in t["results"].values())
+        t["score"] = {"latency": latency, "throughput": throughput,
+                      "balanced": float(np.sqrt(latency * throughput))}[objective]
+    return min(ok, key=lambda t: t["score"])
+
+
+def tune(output, threads, inter_threads, onednn, jit, batch_sizes, iterations, objective, stand_in, timeout):
+    if 1 not in batch_sizes:
+        batch_sizes = [1] + batch_sizes  # latency is always judged at batch 1
+    combinations = list(itertools.product(threads, inter_threads, onednn, jit))
+    trials = []
+    for i, (intra, inter, use_onednn, use_jit) in enumerate(combinations, 1):
+        settings = {"intra_op_threads": intra, "inter_op_threads": inter, "onednn": use_onednn,
+                    "jit_compile": use_jit}
+        results, error = trial_in_subprocess(settings, batch_sizes, iterations, stand_in, timeout)
+        trials.append(dict(settings, results=results, error=error))
+        if error:
+            print(f"[{i}/{len(combinations)}] {settings}: {error}")
+        else:
+            summary = "  ".join(f"b{b}: {r['p50_ms']:.1f} ms, {r['throughput_per_s']:.1f}/s"
+                                for b, r in results.items())
+            print(f"[{i}/{len(combinations)}] {settings}: {summary}")
+    if not any(t["results"] for t in trials):
+        raise SystemExit("Every trial failed; no profile written")
+
+    best = score_trials(trials, objective)
+    best_batch = max(best["results"], key=lambda b: best["results"][b]["throughput_per_s"])
+    profile = {
+        "intra_op_threads": best["intra_op_threads"],
+        "inter_op_threads": best["inter_op_threads"],
+        "onednn": best["onednn"],
+        "jit_compile": best["jit_compile"],
+        "batch_size": int(best_batch),
+        "objective": objective,
+        "models": "stand-in" if stand_in else "keras files",
+        "host": host_info(),
+        "trials": trials,
+    }
+    with open(output, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Best ({objective}): {describe(profile)}")
+    print(f"Profile written to {output}")
+    return profile
+
+
+def on_off(value):
+    return {"on": True, "off": False}[value]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find and inspect CPU tuning profiles.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    tune_parser = commands.add_parser("tune", help="Benchmark setting combinations and save the best")
+    tune_parser.add_argument("--output", default="tuning_profile.json")
+    tune_parser.add_argument("--threads", type=int, nargs="+", default=None,
+                             help=f"Intra-op thread counts (default: {' '.join(map(str, default_thread_counts()))})")
+    tune_parser.add_argument("--inter-threads", type=int, nargs="+", default=[1, 2])
+    tune_parser.add_argument("--onednn", type=on_off, nargs="+", default=[True, False], help="on and/or off")
+    tune_parser.add_argument("--jit", type=on_off, nargs="+", default=[False, True], help="on and/or off")
+    tune_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    tune_parser.add_argument("--iterations", type=int, default=30)
+    tune_parser.add_argument("--objective", choices=OBJECTIVES, default="balanced")
+    tune_parser.add_argument("--stand-in", action="store_true", help="Use small stand-in models instead of the .keras files")
+    tune_parser.add_argument("--timeout", type=float, default=600, help="Seconds allowed per trial")
+
+    show_parser = commands.add_parser("show", help="Print a saved profile")
+    show_parser.add_argument("profile")
+
+    trial_parser = commands.add_parser("trial", help=argparse.SUPPRESS)
+    trial_parser.add_argument("settings")
+    trial_parser.add_argument("--batch-sizes", type=int, nargs="+", required=True)
+    trial_parser.add_argument("--iterations", type=int, required=True)
+    trial_parser.add_argument("--stand-in", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.command == "trial":
+        results = run_trial(json.loads(args.settings), args.batch_sizes, args.iterations, args.stand_in)
+        print(json.dumps(results))
+        return 0
+    if args.command == "show":
+        with open(args.profile) as f:
+            profile = json.load(f)
+        print(describe(profile))
+        print(f"objective={profile['objective']} models={profile['models']} host={profile['host']}")
+        return 0
+
+    tune(args.output, args.threads or default_thread_counts(), args.inter_threads, args.onednn, args.jit,
+         args.batch_sizes, args.iterations, args.objective, args.stand_in, args.timeout)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    sys.exit(main())
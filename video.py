@@ -0,0 +1,152 @@
+"""Eye videos: streaming frame sampling, batched scoring and temporal aggregation.
+
+Frames are read one at a time with cv2.VideoCapture, so a clip is never held in
+memory. Frames are sampled at about `sample_fps`. A sampled frame is dropped
+when it is blurry or barely differs from the last kept one, and a run of
+near-duplicates stretches the sampling step so a still clip costs little. Kept
+frames go through the cascade in batches. Their probabilities are averaged
+(weighted by how sure EyeDetect is that the frame shows an eye) and gated like
+a single image, and the frame that best supports the result is returned with it.
+"""
+import logging
+
+import numpy as np
+import cv2
+
+from config import MODEL_INPUT_SIZE
+from inference import (
+    detection_label, condition_label, eye_blocks_condition, NO_EYE_INDEX,
+)
+from imaging import map_box, crop_box
+from autocrop import propose_crop
+from quality import sharpness
+
+logger = logging.getLogger(__name__)
+
+_THUMBNAIL_SIZE = (64, 56)
+
+
+def sample_frames(path, stats=None, sample_fps=4.0, max_frames=48, min_sharpness=30.0, duplicate_threshold=4.0,
+                  max_step_factor=8):
+    """Yields (frame_index, seconds, frame_bgr, sharpness) for the frames worth scoring.
+
+    `stats`, if given, is filled with "frames_read", "kept", "blurry" and "duplicates".
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("could not open video")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    base_step = max(1, round(fps / sample_fps))
+    step = base_step
+    stats = stats if stats is not None else {}
+    stats.update(frames_read=0, kept=0, blurry=0, duplicates=0)
+    last_thumbnail = None
+    index = -1
+    try:
+        while stats["kept"] < max_frames:
+            # grab() skips the colour conversion and copy of frames we will not look at
+            for _ in range(step - 1):
+                if not capture.grab():
+                    return
+                index += 1
+            ok, frame = capture.read()
+            if not ok:
+                return
+            index += 1
+            stats["frames_read"] = index + 1
+
+            thumbnail = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), _THUMBNAIL_SIZE,
+                                   interpolation=cv2.INTER_AREA).astype(np.int16)
+            if last_thumbnail is not None and np.abs(thumbnail - last_thumbnail).mean() < duplicate_threshold:
+                stats["duplicates"] += 1
+                step = min(step * 2, base_step * max_step_factor)
+                continue
+            step = base_step
+            frame_sharpness = sharpness(frame)
+            if frame_sharpness < min_sharpness:
+                stats["blurry"] += 1
+                continue
+            last_thumbnail = thumbnail
+            stats["kept"] += 1
+            yield index, index / fps, frame, frame_sharpness
+    finally:
+        capture.release()
+
+
+def locate_eye(frame, first_model, min_confidence=0.5, max_windows=32):
+    """A (left, top, right, bottom) eye box for `frame`, or None to use the whole frame."""
+    height, width = frame.shape[:2]
+    scale = min(1.0, 700 / max(height, width))
+    proxy = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else frame
+    proposal = propose_crop(proxy, first_model, max_windows=max_windows)
+    if proposal is None or proposal["confidence"] < min_confidence:
+        return None
+    return map_box(proposal["box"], proxy.shape, frame.shape)
+
+
+def analyze_video(path, predict_batch, first_model=None, batch_size=16, **sampling):
+    """Scores a video and returns a result dict like a single-image analysis, plus
+    "frames" (how many were scored), "sampling" stats and "best_frame".
+
+    `predict_batch` takes a uint8 BGR batch of model-size crops and returns one
+    `decode_cascade` result per crop, e.g. by way of the shared batcher.
+
+    With `first_model` given, the eye is located once, on the first kept frame,
+    and that box is used for every frame (eye videos are held fairly still).
+    Otherwise whole frames are scored. "best_frame" holds the frame's index,
+    time in seconds and its crop at model input size (BGR).
+    """
+    box = None
+    located = first_model is None
+    detections, conditions = [], []
+    best = {"score": -1.0}
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        batch = np.stack([crop for _, _, crop in pending])
+        results = predict_batch(batch)
+        for (index, seconds, crop), result in zip(pending, results):
+            detection, condition = result["detection"], result["condition"]
+            detections.append(detection)
+            conditions.append(condition)
+            # A frame is a good example when it clearly shows an eye and a clear-cut condition
+            score = float((1.0 - detection[NO_EYE_INDEX]) * condition.max())
+            if score > best["score"]:
+                best.update(score=score, index=index, seconds=seconds, image=crop)
+        pending.clear()
+
+    sampling_stats = {}
+    for index, seconds, frame, _ in sample_frames(path, sampling_stats, **sampling):
+        if not located:
+            box = locate_eye(frame, first_model)
+            located = True
+        crop = crop_box(frame, box) if box is not None else frame
+        crop = cv2.resize(crop, MODEL_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+        pending.append((index, seconds, crop))
+        if len(pending) == batch_size:
+            flush()
+    flush()
+
+    if not detections:
+        return {"frames": 0, "sampling": sampling_stats, "best_frame": None}
+
+    detections, conditions = np.array(detections), np.array(conditions)
+    eye_probability = 1.0 - detections[:, NO_EYE_INDEX]
+    weights = eye_probability / eye_probability.sum() if eye_probability.sum() > 0 else None
+    eye_label, eye_confidence = detection_label(detections.mean(axis=0))
+    condition_name, condition_confidence = condition_label(np.average(conditions, axis=0, weights=weights))
+    no_eye = eye_blocks_condition(eye_label, eye_confidence)
+    logger.info("Video: scored %d frames (%s), result %s", len(detections), sampling_stats,
+                "No Eye Detected" if no_eye else condition_name)
+    return {
+        "eye_label": eye_label,
+        "eye_confidence": eye_confidence,
+        "no_eye": no_eye,
+        "condition_label": condition_name,
+        "condition_confidence": condition_confidence,
+        "frames": len(detections),
+        "sampling": sampling_stats,
+        "best_frame": {key: best[key] for key in ("index", "seconds", "image")},
+    }
@@ -0,0 +1,355 @@
+"""Inference in separate worker processes, fed through shared-memory ring buffers.
+
+Each worker process loads both models and builds the cascade. Every worker owns
+a ring of `slots` 320x280 uint8 BGR crops in shared memory. The
+parent writes an image straight into a free slot and sends the worker only the
+slot number, and the worker batches whatever slots are queued (a plain view
+when they are consecutive), so no image is ever pickled. Results are small
+dicts and come back over a queue.
+
+When every ring is full, requests wait in a queue inside the pool and are
+written to a ring as slots free up, so `submit` never blocks its caller (the
+API calls it from the event loop).
+
+A monitor thread restarts workers that die or stay busy on one batch for longer
+than `stall_timeout`. Requests that were in flight on such a worker fail with
+WorkerCrashed instead of hanging. A worker that cannot start (it reports a
+loading error, or dies `max_start_failures` times in a row before it is ready)
+fails the whole pool instead of being restarted forever.
+
+`WorkerPool` has the same submit/predict/stats interface as `MicroBatcher`.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import shared_memory, spawn
+
+import numpy as np
+
+import metrics
+from config import MODEL_INPUT_SIZE, INFERENCE_BACKEND, TTA_VIEWS
+from tuning import apply_profile, profile_jit_compile
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process handling a request died or stalled."""
+
+
+def resolve_worker_count(setting, cpu_count=None):
+    """Turns the OCUSCAN_INFERENCE_WORKERS setting into a process count:
+    "off" or "0" disables the pool, "auto" uses one worker per two cores."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    setting = str(setting).strip().lower()
+    if setting in ("", "off", "0"):
+        return 0
+    if setting == "auto":
+        return max(1, cpu_count // 2)
+    return max(0, int(setting))
+
+
+_spawn_lock = threading.Lock()
+
+
+def _start_without_main(process):
+    """Starts a spawned process without re-running the parent's __main__ in it.
+
+    A spawned child normally runs the parent's main script before its target.
+    Under Streamlit that is the whole app script, which would start a pool of
+    its own; the workers need nothing from it.
+    """
+    original = spawn.get_preparation_data
+
+    def preparation_data(name):
+        data = original(name)
+        data.pop("init_main_from_path", None)
+        data.pop("init_main_from_name", None)
+        return data
+
+    with _spawn_lock:
+        spawn.get_preparation_data = preparation_data
+        try:
+            process.start()
+        finally:
+            spawn.get_preparation_data = original
+
+
+def _ring_array(shm, slots):
+    width, height = MODEL_INPUT_SIZE
+    return np.ndarray((slots, height, width, 3), dtype=np.uint8, buffer=shm.buf)
+
+
+def _worker_main(worker_id, shm_name, slots, requests, results, busy_since, max_batch_size, threads, profile):
+    """Runs in the worker process: load the models, then serve batches of slots."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the parent
+    try:
+        if INFERENCE_BACKEND == "keras":
+            # Before anything imports TensorFlow, or oneDNN would keep its default
+            apply_profile(profile, max_threads=threads)
+        from inference import load_models, build_cascade, run_cascade, decode_cascade
+        from model_loader import warm_up_input
+        cascade = build_cascade(*load_models(), jit_compile=profile_jit_compile(profile), tta_views=TTA_VIEWS)
+        cascade(warm_up_input(dtype=np.uint8))
+        shm = shared_memory.SharedMemory(name=shm_name)
+        ring = _ring_array(shm, slots)
+    except BaseException as e:
+        results.put(("failed", worker_id, f"{type(e).__name__}: {e}"))
+        return
+    results.put(("ready", worker_id, os.getpid()))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        batch = [message]
+        while len(batch) < max_batch_size:
+            try:
+                message = requests.get_nowait()
+            except queue.Empty:
+                break
+            if message is None:
+                requests.put(None)
+                break
+            batch.append(message)
+
+        request_ids = [request_id for request_id, _ in batch]
+        batch_slots = [slot for _, slot in batch]
+        first = batch_slots[0]
+        if batch_slots == list(range(first, first + len(batch_slots))):
+            images = ring[first:first + len(batch_slots)]  # consecutive slots: no copy at all
+        else:
+            images = ring[batch_slots]
+        busy_since.value = time.monotonic()
+        start = time.perf_counter()
+        try:
+            outcome = decode_cascade(run_cascade(cascade, images))
+        except Exception as e:
+            outcome = f"{type(e).__name__}: {e}"
+        busy_since.value = 0.0
+        results.put(("done", worker_id, request_ids, outcome, time.perf_counter() - start))
+    shm.close()
+
+
+class _Worker:
+    """Parent-side state of one worker process and its ring buffer."""
+
+    def __init__(self, worker_id, slots):
+        width, height = MODEL_INPUT_SIZE
+        self.id = worker_id
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * height * width * 3)
+        self.ring = _ring_array(self.shm, slots)
+        self.free = deque(range(slots))
+        self.in_flight = {}  # request id -> (future, slot)
+        self.busy_since = multiprocessing.get_context("spawn").Value("d", 0.0, lock=False)
+        self.process = None
+        self.requests = None
+        self.ready = False
+        self.restarts = 0
+        self.failed_starts = 0  # deaths in a row before reporting ready
+
+
+class WorkerPool:
+    """Runs the cascade in `num_workers` processes; see the module docstring.
+
+    `threads_per_worker` defaults to an even share of the cores, so the pool as
+    a whole uses every core once without oversubscribing them. `profile` is a
+    tuning profile (see tuning.py): each worker applies its oneDNN and
+    jit_compile settings, and its thread counts capped at `threads_per_worker`.
+    """
+
+    def __init__(self, num_workers, slots_per_worker=16, max_batch_size=8, threads_per_worker=None,
+                 stall_timeout=60.0, health_interval=1.0, max_start_failures=3, profile=None):
+        self.num_workers = max(1, int(num_workers))
+        self.max_batch_size = max_batch_size
+        self.profile = profile
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers)
+        self.stall_timeout = stall_timeout
+        self.health_interval = health_interval
+        self.max_start_failures = max_start_failures
+        self.error = None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._batches = 0
+        self._requests = 0
+        self._largest_batch = 0
+        self._pending = deque()  # (future, image) waiting for a free slot
+        self._closed = False
+        self._workers = [_Worker(i, slots_per_worker) for i in range(self.num_workers)]
+        for worker in self._workers:
+            self._spawn(worker)
+        threading.Thread(target=self._collect, name="worker-pool-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="worker-pool-monitor", daemon=True).start()
+        # Shared memory outlives the process unless it is unlinked
+        atexit.register(self.close)
+
+    # --- Public API ---
+    def submit(self, image):
+        """Queues one `fit_to_model` crop for a worker's ring and returns a Future;
+        never blocks."""
+        if image.dtype != np.uint8:
+            raise TypeError(f"the cascade takes uint8 BGR crops, got {image.dtype}")
+        future = Future()
+        with self._lock:
+            if self.error is not None or self._closed:
+                future.set_exception(WorkerCrashed(self.error or "the worker pool was closed"))
+                return future
+            self._pending.append((future, image))
+            self._dispatch()
+        return future
+
+    def predict(self, image, timeout=None):
+        return self.submit(image).result(timeout)
+
+    def ready(self):
+        with self._lock:
+            return all(worker.ready for worker in self._workers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": len(self._pending) + sum(len(worker.in_flight) for worker in self._workers),
+                "batches": self._batches,
+                "requests": self._requests,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "workers_ready": sum(worker.ready for worker in self._workers),
+                "restarts": sum(worker.restarts for worker in self._workers),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for worker in self._workers:
+                worker.requests.put(None)
+            while self._pending:
+                future, _ = self._pending.popleft()
+                future.set_exception(WorkerCrashed("the worker pool was closed"))
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+            worker.shm.close()
+            worker.shm.unlink()
+
+    # --- internals ---
+    def _spawn(self, worker):
+        worker.requests = self._ctx.Queue()
+        worker.ready = False
+        worker.busy_since.value = 0.0
+        worker.process = self._ctx.Process(
+            target=_worker_main, name=f"inference-worker-{worker.id}", daemon=True,
+            args=(worker.id, worker.shm.name, worker.slots, worker.requests, self._results,
+                  worker.busy_since, self.max_batch_size, self.threads_per_worker, self.profile))
+        _start_without_main(worker.process)
+
+    def _dispatch(self):
+        """Moves queued requests into free ring slots, least loaded worker first.
+        Called with the lock held whenever a request arrives or a slot frees up."""
+        while self._pending and not self._closed:
+            candidates = [w for w in self._workers if w.free and w.process.is_alive()]
+            if not candidates:
+                return
+            worker = min(candidates, key=lambda w: (not w.ready, len(w.in_flight)))
+            future, image = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            slot = worker.free.popleft()
+            request_id = self._next_id
+            self._next_id += 1
+            worker.ring[slot] = image
+            worker.in_flight[request_id] = (future, slot)
+            worker.requests.put((request_id, slot))
+
+    def _collect(self):
+        while True:
+            message = self._results.get()
+            kind, worker_id = message[0], message[1]
+            with self._lock:
+                worker = self._workers[worker_id]
+                if kind == "ready":
+                    worker.ready = True
+                    worker.failed_starts = 0
+                    logger.info("Inference worker %d ready (pid %d)", worker_id, message[2])
+                elif kind == "failed":
+                    # Loading failed, so restarting would only fail again
+                    self._fail(f"inference worker {worker_id} failed to start: {message[2]}")
+                elif kind == "done":
+                    _, _, request_ids, outcome, seconds = message
+                    self._finish(worker, request_ids, outcome, seconds)
+                self._dispatch()
+
+    def _finish(self, worker, request_ids, outcome, seconds):
+        size = len(request_ids)
+        self._batches += 1
+        self._requests += size
+        self._largest_batch = max(self._largest_batch, size)
+        metrics.observe("ocuscan_stage_seconds", seconds, stage="worker_batch")
+        for i, request_id in enumerate(request_ids):
+            entry = worker.in_flight.pop(request_id, None)
+            if entry is None:
+                continue  # Already failed by the monitor
+            future, slot = entry
+            worker.free.append(slot)
+            if isinstance(outcome, str):
+                future.set_exception(RuntimeError(outcome))
+            else:
+                future.set_result(outcome[i])
+
+    def _fail(self, error):
+        """Marks the pool failed: every queued and in-flight request gets the error."""
+        self.error = error
+        logger.error(error)
+        for worker in self._workers:
+            self._fail_in_flight(worker, error)
+        while self._pending:
+            future, _ = self._pending.popleft()
+            future.set_exception(WorkerCrashed(error))
+
+    def _fail_in_flight(self, worker, reason):
+        for future, slot in worker.in_flight.values():
+            worker.free.append(slot)
+            future.set_exception(WorkerCrashed(reason))
+        worker.in_flight.clear()
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.health_interval)
+            with self._lock:
+                if self._closed or self.error is not None:
+                    return
+                for worker in self._workers:
+                    busy_since = worker.busy_since.value
+                    if not worker.process.is_alive():
+                        reason = f"inference worker {worker.id} exited with code {worker.process.exitcode}"
+                    elif busy_since and time.monotonic() - busy_since > self.stall_timeout:
+                        reason = f"inference worker {worker.id} stalled for over {self.stall_timeout:.0f}s"
+                        worker.process.kill()
+                        worker.process.join()
+                    else:
+                        continue
+                    if not worker.ready:
+                        # Died while starting (import error, killed while loading the models...)
+                        worker.failed_starts += 1
+                        if worker.failed_starts >= self.max_start_failures:
+                            self._fail(f"{reason} before it was ready, {worker.failed_starts} times in a row")
+                            return
+                    logger.error("%s; restarting it", reason)
+                    self._fail_in_flight(worker, reason)
+                    worker.restarts += 1
+                    metrics.inc("ocuscan_worker_restarts_total", worker=str(worker.id))
+                    self._spawn(worker)
+                self._dispatch()
+    
\ No newline at end of file